@@ -13,6 +13,24 @@ const Headers = {
     'X-API-Key': apiKey,
 };
 
+// -- ETag revalidation --
+// list responses carry an ETag; sending it back as If-None-Match gets an empty
+// 304 while nothing changed, and the data from the last 200 is reused
+const etagCache = new Map();
+
+async function fetchRevalidated(url, options, errorMessage) {
+    const key = `${options.method} ${url} ${options.body || ''}`;
+    const cached = etagCache.get(key);
+    const headers = cached ? { ...options.headers, 'If-None-Match': cached.etag } : options.headers;
+    const response = await fetch(url, { ...options, headers });
+    if (response.status === 304 && cached) return cached.data;
+    const data = await handleResponse(response, errorMessage);
+    const etag = response.headers.get('ETag');
+    if (etag) etagCache.set(key, { etag, data });
+    else etagCache.delete(key);
+    return data;
+}
+
 
 
 
@@ -31,13 +49,12 @@ export const ApiService = {
     },
 
     async getDomain() {
-        const data = await handleResponse(
-            await fetch(
-                `${baseUrl}/collections/list`,
-                {
-                    method: 'GET',
-                    headers: Headers
-                }),
+        const data = await fetchRevalidated(
+            `${baseUrl}/collections/list`,
+            {
+                method: 'GET',
+                headers: Headers
+            },
             'Failed to load collections')
 
         // const data = await handleResponse(response, 'Failed to load collections');
@@ -216,14 +233,13 @@ export const ApiService = {
      */
 
     async listNode(name) {
-        const response = await fetch(
+        const data = await fetchRevalidated(
             `${baseUrl}/nodes/list`, {
             method: 'POST',
             headers: Headers,
             body: JSON.stringify({ name }),
-        }
-        );
-        const data = await handleResponse(response, "Failed to list nodes");
+        },
+            "Failed to list nodes");
         return data.map(item => new Node(item));
     },
 
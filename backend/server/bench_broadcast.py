@@ -0,0 +1,82 @@
+# -- benchmark: websocket notification fan-out --
+#
+# fake sockets, one of them stuck (its send takes --slow-ms). compares the old
+# sequential `for ws in clients: await ws.send_text(...)` loop with
+# broadcaster.Broadcaster: how long the notifying request is held up and how
+# long until every healthy client has the message.
+#
+# run (inside /server):
+#   python bench_broadcast.py --clients 10 100 1000 5000 --slow-ms 500
+
+import argparse
+import asyncio
+import time
+
+from broadcaster import Broadcaster
+
+
+class FakeSocket:
+    def __init__(self, delay: float = 0.0):
+        self.delay = delay
+        self.received = asyncio.Event()
+
+    async def send_text(self, message: str):
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        else:
+            await asyncio.sleep(0)  # a real send yields to the loop too
+        self.received.set()
+
+    async def close(self, code: int = 1000):
+        pass
+
+
+async def sequential(sockets):
+    for ws in sockets:
+        await ws.send_text("{}")
+
+
+async def run(n: int, slow_ms: float):
+    # the stuck client connected first, the worst case for the old loop
+    sockets = [FakeSocket(slow_ms / 1000)] + [FakeSocket() for _ in range(n - 1)]
+    healthy = sockets[1:]
+
+    started = time.perf_counter()
+    await sequential(sockets)
+    old_return = time.perf_counter() - started
+    old_all = old_return
+
+    for ws in sockets:
+        ws.received.clear()
+    broadcaster = Broadcaster(send_timeout=slow_ms / 1000 / 2)
+    for ws in sockets:
+        broadcaster.register(ws)
+    await asyncio.sleep(0)
+    started = time.perf_counter()
+    broadcaster.broadcast("{}")
+    new_return = time.perf_counter() - started
+    await asyncio.gather(*(ws.received.wait() for ws in healthy))
+    new_all = time.perf_counter() - started
+    await asyncio.sleep(slow_ms / 1000)
+    stats = broadcaster.stats()
+    for ws in sockets:
+        await broadcaster.unregister(ws)
+
+    print(
+        f"{n:6d} clients | old: request held {old_return * 1000:8.1f} ms, all healthy {old_all * 1000:8.1f} ms"
+        f" | new: request held {new_return * 1000:6.2f} ms, all healthy {new_all * 1000:7.1f} ms"
+        f" | timeouts {stats['send_timeouts']}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Broadcast benchmark")
+    parser.add_argument("--clients", type=int, nargs="+", default=[10, 100, 1000, 5000])
+    parser.add_argument("--slow-ms", type=float, default=500)
+    args = parser.parse_args()
+    for n in args.clients:
+        asyncio.run(run(n, args.slow_ms))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+# -- benchmark: query-based vs vectorized semantic link refactor --
+#
+# builds a throwaway in-memory chroma collection with random embeddings, runs
+# the old one-collection.query-per-node refactor and the blocked numpy version
+# (graph_links.knn_links), and checks that both produce the same links.
+#
+# run (inside /server):
+#   python bench_refactor.py --nodes 5000 --dim 768 --max-links 5 --threshold 1.2
+
+import argparse
+import time
+import uuid
+
+import chromadb
+import numpy as np
+
+from graph_links import approx_knn_links, collection_space, knn_links, link_recall
+
+
+def query_links(collection, ids, embeddings, max_links, distance_threshold):
+    """The original /nodes/refactor loop: one collection.query per node."""
+    result = []
+    for node_id, embedding in zip(ids, embeddings):
+        q_result = collection.query(
+            query_embeddings=embedding,
+            n_results=max_links,
+            include=["distances"],
+        )
+        s_links = []
+        for i, id in enumerate(q_result["ids"][0]):
+            if id != node_id and q_result["distances"][0][i] <= distance_threshold:
+                s_links.append(id)
+        result.append(s_links)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Refactor benchmark")
+    parser.add_argument("--nodes", type=int, default=5000)
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--max-links", type=int, default=5)
+    parser.add_argument("--threshold", type=float, default=1.2)
+    parser.add_argument("--workers", type=int, default=0)
+    parser.add_argument("--recall-target", type=float, default=0.95)
+    args = parser.parse_args()
+
+    # normalized vectors like all-mpnet-base-v2 produces
+    rng = np.random.default_rng(0)
+    embeddings = rng.normal(size=(args.nodes, args.dim)).astype(np.float32)
+    embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+    ids = [str(uuid.uuid1()) for _ in range(args.nodes)]
+
+    client = chromadb.EphemeralClient()
+    collection = client.create_collection(name=f"bench-{uuid.uuid4().hex[:8]}")
+    step = client.get_max_batch_size()
+    for i in range(0, args.nodes, step):
+        collection.add(ids=ids[i : i + step], embeddings=embeddings[i : i + step])
+
+    # read back exactly what the endpoint would see
+    stored = collection.get(include=["embeddings"])
+    ids = stored["ids"]
+    embeddings = np.asarray(stored["embeddings"], dtype=np.float32)
+
+    started = time.perf_counter()
+    old = query_links(collection, ids, embeddings, args.max_links, args.threshold)
+    old_time = time.perf_counter() - started
+
+    started = time.perf_counter()
+    new = knn_links(
+        ids,
+        embeddings,
+        args.max_links,
+        args.threshold,
+        space=collection_space(collection),
+        workers=args.workers or None,
+    )
+    new_time = time.perf_counter() - started
+
+    started = time.perf_counter()
+    approx, report = approx_knn_links(
+        ids,
+        embeddings,
+        args.max_links,
+        args.threshold,
+        space=collection_space(collection),
+        recall_target=args.recall_target,
+        workers=args.workers or None,
+    )
+    approx_time = time.perf_counter() - started
+    recall = link_recall(approx, new)
+
+    same = sum(a == [id for id, _ in b] for a, b in zip(old, new))
+    print(f"nodes: {args.nodes}, dim: {args.dim}, max_links: {args.max_links}, threshold: {args.threshold}")
+    print(f"query-based : {old_time:8.3f} s")
+    print(f"vectorized  : {new_time:8.3f} s")
+    print(f"speedup     : {old_time / new_time:8.1f}x")
+    # chroma's hnsw index is approximate, so on big collections a few rows can
+    # differ where hnsw missed a true neighbor; the numpy path is exact
+    print(f"same links  : {same}/{len(ids)} nodes")
+    print(f"approximate : {approx_time:8.3f} s  ({old_time / approx_time:.1f}x, recall {recall:.4f} vs exact)")
+    print(f"              {report}")
+
+
+if __name__ == "__main__":
+    main()
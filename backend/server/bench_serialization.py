@@ -0,0 +1,76 @@
+# -- benchmark: /nodes/list encoding --
+#
+# encodes a synthetic node list the old way (a NodeOut pydantic object per
+# node rendered by JSONResponse) and the new way (plain dicts through
+# serialization.dumps, as orjson and as MessagePack).
+#
+# run (inside /server):
+#   python bench_serialization.py --nodes 10000 --content-chars 600 --links 5
+
+import argparse
+import time
+import uuid
+from typing import List
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+
+from serialization import JSON, MSGPACK, dumps
+
+
+# the response model /nodes/list used before
+class NodeOut(BaseModel):
+    node_id: str
+    name: str
+    content: str
+    user_links: List[str]
+    s_links: List[str]
+
+
+def timed(fn, repeat):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serialization benchmark")
+    parser.add_argument("--nodes", type=int, default=10000)
+    parser.add_argument("--content-chars", type=int, default=600)
+    parser.add_argument("--links", type=int, default=5)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    ids = [str(uuid.uuid1()) for _ in range(args.nodes)]
+    rows = [
+        {
+            "node_id": node_id,
+            "name": f"node {i}",
+            "content": ("lorem ipsum dolor sit amet, äöü " * (args.content_chars // 32 + 1))[: args.content_chars],
+            "user_links": [ids[(i + 1) % len(ids)]],
+            "s_links": [ids[(i * 7 + k) % len(ids)] for k in range(1, args.links + 1)],
+        }
+        for i, node_id in enumerate(ids)
+    ]
+
+    def old():
+        nodes = [NodeOut(**row) for row in rows]
+        return JSONResponse(content=jsonable_encoder(nodes)).body
+
+    old_time, old_body = timed(old, args.repeat)
+    json_time, json_body = timed(lambda: dumps(rows, JSON), args.repeat)
+    msgpack_time, msgpack_body = timed(lambda: dumps(rows, MSGPACK), args.repeat)
+
+    print(f"nodes: {args.nodes}, content: {args.content_chars} chars, s_links: {args.links}")
+    print(f"pydantic + JSONResponse : {old_time * 1000:9.1f} ms  {len(old_body) / 1e6:7.2f} MB")
+    print(f"dicts + orjson          : {json_time * 1000:9.1f} ms  {len(json_body) / 1e6:7.2f} MB  ({old_time / json_time:.1f}x)")
+    print(f"dicts + msgpack         : {msgpack_time * 1000:9.1f} ms  {len(msgpack_body) / 1e6:7.2f} MB  ({old_time / msgpack_time:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,204 @@
+# -- websocket fan-out --
+#
+# notify_clients used to await ws.send_text for one client after the other, so
+# a single slow socket held up everybody and an error on a closed one stopped
+# the loop. each connection now has its own small send queue and writer task;
+# broadcasting only puts the message in every queue and returns.
+#
+# a message with a coalesce key replaces the still-unsent message with the same
+# key (a newer "node" for the same collection, the next progress update of the
+# same job), so a slow client gets the latest state instead of a backlog. when
+# a queue is full anyway the oldest message is dropped, and a client that keeps
+# overflowing or does not take a send within send_timeout is disconnected.
+#
+# messages can carry a topic (the collection they are about). a connection that
+# subscribed to topics only gets messages for those, plus the ones without a
+# topic; connections that never subscribed get everything, as before.
+
+import asyncio
+import itertools
+import time
+from collections import OrderedDict
+from typing import Dict, Hashable, Iterable, List, Optional, Set
+
+
+class _Connection:
+    __slots__ = ("ws", "pending", "wakeup", "writer", "sent", "dropped", "coalesced", "overflow_streak", "topics")
+
+    def __init__(self, ws):
+        self.ws = ws
+        self.pending: "OrderedDict[Hashable, str]" = OrderedDict()
+        self.wakeup = asyncio.Event()
+        self.writer: Optional[asyncio.Task] = None
+        self.sent = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.overflow_streak = 0
+        self.topics: Optional[Set[str]] = None  # None: not subscribed, gets everything
+
+
+class Broadcaster:
+    def __init__(self, queue_size: int = 64, send_timeout: float = 5.0):
+        self.queue_size = max(1, int(queue_size))
+        self.send_timeout = send_timeout
+        self._connections: Dict[object, _Connection] = {}
+        self._unique = itertools.count()
+        self._closing = set()  # keeps slow-consumer disconnect tasks referenced
+
+        # -- stats --
+        self._broadcasts = 0
+        self._broadcast_sum = 0.0
+        self._broadcast_max = 0.0
+        self._sent = 0
+        self._dropped = 0
+        self._coalesced = 0
+        self._timeouts = 0
+        self._send_errors = 0
+        self._slow_disconnects = 0
+        self._filtered = 0
+
+    # -- connections --
+
+    def register(self, ws) -> _Connection:
+        connection = _Connection(ws)
+        connection.writer = asyncio.create_task(self._write(connection))
+        self._connections[ws] = connection
+        return connection
+
+    async def unregister(self, ws):
+        connection = self._connections.pop(ws, None)
+        if connection is None or connection.writer is None or connection.writer is asyncio.current_task():
+            return
+        connection.writer.cancel()
+        try:
+            await connection.writer
+        except (asyncio.CancelledError, Exception):
+            pass
+
+    def __len__(self):
+        return len(self._connections)
+
+    # -- subscriptions --
+
+    def subscribe(self, ws, topics: Iterable[str]) -> List[str]:
+        """Limits the connection to these topics (adding to earlier ones). Returns its topics."""
+        connection = self._connections.get(ws)
+        if connection is None:
+            return []
+        if connection.topics is None:
+            connection.topics = set()
+        connection.topics.update(topics)
+        return sorted(connection.topics)
+
+    def unsubscribe(self, ws, topics: Optional[Iterable[str]] = None) -> List[str]:
+        """Drops the given topics, or all of them (the connection then only gets topic-less messages)."""
+        connection = self._connections.get(ws)
+        if connection is None:
+            return []
+        if topics is None:
+            connection.topics = set()
+        elif connection.topics is not None:
+            connection.topics.difference_update(topics)
+        return sorted(connection.topics or ())
+
+    def send(self, ws, message: str) -> bool:
+        """Queues a message for one connection (replies), behind what it already has pending."""
+        connection = self._connections.get(ws)
+        return connection is not None and self._enqueue(connection, message, None)
+
+    # -- public api --
+
+    def broadcast(self, message: str, key: Optional[Hashable] = None, topic: Optional[str] = None) -> int:
+        """Queues message for every interested connection without waiting on any of them. Returns how many got it."""
+        started = time.perf_counter()
+        delivered = 0
+        for connection in list(self._connections.values()):
+            if topic is not None and connection.topics is not None and topic not in connection.topics:
+                self._filtered += 1
+                continue
+            if self._enqueue(connection, message, key):
+                delivered += 1
+        elapsed = time.perf_counter() - started
+        self._broadcasts += 1
+        self._broadcast_sum += elapsed
+        self._broadcast_max = max(self._broadcast_max, elapsed)
+        return delivered
+
+    def stats(self) -> dict:
+        depths = [len(c.pending) for c in self._connections.values()]
+        broadcasts = self._broadcasts or 1
+        return {
+            "connections": len(depths),
+            "subscribed_connections": sum(c.topics is not None for c in self._connections.values()),
+            "queue_size": self.queue_size,
+            "queued": sum(depths),
+            "max_queue_depth": max(depths, default=0),
+            "broadcasts": self._broadcasts,
+            "mean_broadcast_ms": round(self._broadcast_sum / broadcasts * 1000, 3),
+            "max_broadcast_ms": round(self._broadcast_max * 1000, 3),
+            "sent": self._sent,
+            "coalesced": self._coalesced,
+            "dropped": self._dropped,
+            "send_timeouts": self._timeouts,
+            "send_errors": self._send_errors,
+            "slow_disconnects": self._slow_disconnects,
+            "filtered": self._filtered,
+        }
+
+    # -- internals --
+
+    def _enqueue(self, connection: _Connection, message: str, key: Optional[Hashable]) -> bool:
+        pending = connection.pending
+        if key is not None and key in pending:
+            # newer state for the same thing: replace it, keep its place in line
+            pending[key] = message
+            connection.coalesced += 1
+            self._coalesced += 1
+            return True
+        if len(pending) >= self.queue_size:
+            pending.popitem(last=False)
+            connection.dropped += 1
+            self._dropped += 1
+            connection.overflow_streak += 1
+            if connection.overflow_streak > self.queue_size:
+                # it is not reading at all, stop paying for it
+                self._slow_disconnects += 1
+                task = asyncio.create_task(self._drop(connection))
+                self._closing.add(task)
+                task.add_done_callback(self._closing.discard)
+                return False
+        pending[key if key is not None else ("", next(self._unique))] = message
+        connection.wakeup.set()
+        return True
+
+    async def _write(self, connection: _Connection):
+        while True:
+            while not connection.pending:
+                connection.wakeup.clear()
+                await connection.wakeup.wait()
+            _, message = connection.pending.popitem(last=False)
+            try:
+                await asyncio.wait_for(connection.ws.send_text(message), self.send_timeout)
+            except asyncio.TimeoutError:
+                self._timeouts += 1
+                await self._drop(connection)
+                return
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                # closed or broken socket
+                self._send_errors += 1
+                await self._drop(connection)
+                return
+            connection.sent += 1
+            connection.overflow_streak = 0
+            self._sent += 1
+
+    async def _drop(self, connection: _Connection):
+        if self._connections.get(connection.ws) is not connection:
+            return
+        await self.unregister(connection.ws)
+        try:
+            await connection.ws.close(code=1013)  # try again later
+        except Exception:
+            pass
@@ -0,0 +1,222 @@
+# -- chroma repository --
+#
+# chromadb's client is synchronous, and the async handlers used to call it
+# right on the event loop: while one request ran collection.add or .query,
+# nothing else moved, including the tokens of running /query/stream answers.
+# every chroma call now goes through this repository. the work runs on its own
+# small thread pool (not the one starlette and asyncio.to_thread share), and
+# at most max_pending calls are handed to it at a time; the rest wait on the
+# loop without holding a thread.
+#
+# writes to a collection first take that collection's write lock, so two
+# inserts into one domain don't link against each other's half-written state.
+# writes to different collections, and all reads, still run side by side. with
+# several uvicorn workers the lock also has to hold across processes: besides
+# an asyncio.Lock per process, a holder keeps a write transaction open on a
+# small sqlite file of that collection (in lock_dir), which the other workers'
+# BEGIN IMMEDIATE waits for. nothing is ever written to those files.
+# helpers that make several chroma calls in a row (relinking, list rows, the
+# refactor) are handed to run() whole.
+
+import asyncio
+import os
+import re
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Hashable, Optional
+
+
+class WriteLock:
+    """
+    One collection's write lock: an asyncio.Lock within this process and, when
+    path is set, an open write transaction on the sqlite file at path for the
+    other processes. Used as `async with lock: ...`.
+    """
+
+    def __init__(self, path: Optional[str] = None, timeout: float = 600.0):
+        self.path = path
+        self.timeout = timeout
+        self._local = asyncio.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+
+    def locked(self) -> bool:
+        return self._local.locked()
+
+    async def __aenter__(self):
+        await self._local.acquire()
+        if self.path is None:
+            return self
+        # waiting for another worker blocks a thread, not the loop
+        acquiring = asyncio.ensure_future(asyncio.to_thread(self._acquire))
+        try:
+            self._db = await asyncio.shield(acquiring)
+        except BaseException:
+            # a cancelled wait may still get the lock afterwards: let it go right away
+            acquiring.add_done_callback(lambda f: f.cancelled() or f.exception() or f.result().close())
+            self._local.release()
+            raise
+        return self
+
+    async def __aexit__(self, *exc):
+        db, self._db = self._db, None
+        try:
+            if db is not None:
+                # closing ends the (empty) transaction and frees the lock for the other workers
+                await asyncio.shield(asyncio.to_thread(db.close))
+        finally:
+            self._local.release()
+
+    def _acquire(self) -> sqlite3.Connection:
+        db = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None, check_same_thread=False)
+        try:
+            db.execute("BEGIN IMMEDIATE")
+        except Exception:
+            db.close()
+            raise
+        return db
+
+
+class ChromaRepository:
+    def __init__(self, client, max_workers: int = 8, max_pending: int = 64, lock_dir: Optional[str] = None):
+        self.client = client
+        self.lock_dir = lock_dir
+        if lock_dir:
+            os.makedirs(lock_dir, exist_ok=True)
+        self.max_workers = max(1, int(max_workers))
+        self.max_pending = max(self.max_workers, int(max_pending))
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="chroma")
+        self._slots = asyncio.Semaphore(self.max_pending)
+        self._write_locks: Dict[Hashable, WriteLock] = {}
+        self._lock = threading.Lock()  # counters shared with the pool threads
+
+        # -- stats --
+        self._waiting = 0  # for a slot, on the loop
+        self._queued = 0  # submitted, no thread yet
+        self._running = 0
+        self._calls = 0
+        self._errors = 0
+        self._wait_sum = 0.0
+        self._wait_max = 0.0
+        self._run_sum = 0.0
+        self._run_max = 0.0
+
+    # -- lifecycle --
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    # -- running work --
+
+    async def run(self, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        """Runs fn(*args, **kwargs) on the chroma pool and returns its result."""
+        submitted = time.perf_counter()
+        self._waiting += 1
+        try:
+            await self._slots.acquire()
+        finally:
+            self._waiting -= 1
+        with self._lock:
+            self._queued += 1
+
+        def call():
+            started = time.perf_counter()
+            wait = started - submitted
+            with self._lock:
+                self._queued -= 1
+                self._running += 1
+                self._wait_sum += wait
+                self._wait_max = max(self._wait_max, wait)
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - started
+                with self._lock:
+                    self._running -= 1
+                    self._run_sum += elapsed
+                    self._run_max = max(self._run_max, elapsed)
+
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, call)
+        except Exception:
+            self._errors += 1
+            raise
+        finally:
+            self._calls += 1
+            self._slots.release()
+
+    def writing(self, key: Hashable) -> WriteLock:
+        """The write lock of a collection (by id): `async with chroma.writing(collection_id): ...`."""
+        lock = self._write_locks.get(key)
+        if lock is None:
+            path = None
+            if self.lock_dir:
+                path = os.path.join(self.lock_dir, re.sub(r"[^\w.-]", "_", str(key)) + ".lock")
+            lock = self._write_locks[key] = WriteLock(path)
+        return lock
+
+    # -- collections --
+
+    async def list_collections(self) -> list:
+        return await self.run(self.client.list_collections)
+
+    async def get_collection(self, name: str):
+        return await self.run(self.client.get_collection, name)
+
+    async def create_collection(self, name: str):
+        return await self.run(self.client.create_collection, name=name)
+
+    async def delete_collection(self, name: str):
+        await self.run(self.client.delete_collection, name)
+
+    async def rename_collection(self, old: str, new: str):
+        def rename():
+            self.client.get_collection(old).modify(name=new)
+
+        await self.run(rename)
+
+    async def max_batch_size(self) -> int:
+        return await self.run(self.client.get_max_batch_size)
+
+    # -- records --
+    # add / update / delete take the write lock themselves; code that already
+    # holds it (a read-modify-write) hands its whole sync step to run() instead
+
+    async def get(self, collection, **kwargs) -> dict:
+        return await self.run(collection.get, **kwargs)
+
+    async def query(self, collection, **kwargs) -> dict:
+        return await self.run(collection.query, **kwargs)
+
+    async def count(self, collection) -> int:
+        return await self.run(collection.count)
+
+    async def add(self, collection, **kwargs):
+        async with self.writing(str(collection.id)):
+            await self.run(collection.add, **kwargs)
+
+    async def update(self, collection, **kwargs):
+        async with self.writing(str(collection.id)):
+            await self.run(collection.update, **kwargs)
+
+    async def delete(self, collection, **kwargs):
+        async with self.writing(str(collection.id)):
+            await self.run(collection.delete, **kwargs)
+
+    def stats(self) -> dict:
+        calls = self._calls or 1
+        return {
+            "max_workers": self.max_workers,
+            "max_pending": self.max_pending,
+            "waiting": self._waiting,
+            "queued": self._queued,
+            "running": self._running,
+            "calls": self._calls,
+            "errors": self._errors,
+            "mean_wait_ms": round(self._wait_sum / calls * 1000, 2),
+            "max_wait_ms": round(self._wait_max * 1000, 2),
+            "mean_run_ms": round(self._run_sum / calls * 1000, 2),
+            "max_run_ms": round(self._run_max * 1000, 2),
+            "writes_locked": sum(lock.locked() for lock in self._write_locks.values()),
+        }
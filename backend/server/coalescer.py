@@ -0,0 +1,95 @@
+# -- notification coalescing --
+#
+# a script inserting nodes one request at a time used to send one "node"
+# notification per insert, and every browser reloaded the domain for each of
+# them. events with the same key (the collection) are now held for a short
+# window; more events inside the window are merged into the pending one, and
+# one message goes out when the window passes quietly or max_delay after the
+# first event at the latest, so a steady stream still gets updates.
+
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+
+
+class NotificationCoalescer:
+    def __init__(self, window_ms: float = 250.0, max_delay_ms: float = 1000.0):
+        self.window = max(0.0, window_ms / 1000)
+        self.max_delay = max(self.window, max_delay_ms / 1000)
+        self._pending: Dict[Hashable, dict] = {}
+        self._tasks = set()
+
+        # -- stats --
+        self._submitted = 0
+        self._sent = 0
+        self._delay_sum = 0.0
+
+    async def submit(
+        self,
+        key: Hashable,
+        state: Any,
+        send: Callable[[Any, int], Awaitable[None]],
+        merge: Optional[Callable[[Any, Any], Any]] = None,
+    ):
+        """
+        Queues an event. send(state, events) runs once per burst with the merged
+        state and the number of events it stands for; merge(old, new) combines
+        states (default: keep the newest).
+        """
+        self._submitted += 1
+        now = time.monotonic()
+        if self.window == 0:
+            self._sent += 1
+            await send(state, 1)
+            return
+        entry = self._pending.get(key)
+        if entry is not None:
+            entry["state"] = merge(entry["state"], state) if merge else state
+            entry["events"] += 1
+            entry["last"] = now
+            return
+        self._pending[key] = {"state": state, "events": 1, "first": now, "last": now, "send": send}
+        task = asyncio.create_task(self._flush_later(key))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def flush(self):
+        """Sends everything pending now (shutdown)."""
+        for key in list(self._pending):
+            await self._send(key)
+
+    def stats(self) -> dict:
+        sent = self._sent or 1
+        return {
+            "window_ms": round(self.window * 1000, 1),
+            "max_delay_ms": round(self.max_delay * 1000, 1),
+            "pending": len(self._pending),
+            "events": self._submitted,
+            "messages": self._sent,
+            # a pending entry becomes one message, the rest of its events are already absorbed
+            "absorbed": self._submitted - self._sent - len(self._pending),
+            "mean_delay_ms": round(self._delay_sum / sent * 1000, 1),
+        }
+
+    async def _flush_later(self, key: Hashable):
+        while True:
+            entry = self._pending.get(key)
+            if entry is None:
+                return
+            due = min(entry["last"] + self.window, entry["first"] + self.max_delay)
+            wait = due - time.monotonic()
+            if wait <= 0:
+                break
+            await asyncio.sleep(wait)
+        await self._send(key)
+
+    async def _send(self, key: Hashable):
+        entry = self._pending.pop(key, None)
+        if entry is None:
+            return
+        self._sent += 1
+        self._delay_sum += time.monotonic() - entry["first"]
+        try:
+            await entry["send"](entry["state"], entry["events"])
+        except Exception as e:
+            print(f"Warning: coalesced notification for {key} failed: {e}")
@@ -0,0 +1,172 @@
+# -- token-budgeted rag context --
+#
+# query_stream used to join every retrieved document, whatever its length.
+# with num_ctx=4096 long nodes got cut off by ollama or blew up prompt
+# processing, which is most of the time to first token on cpu. the context is
+# now packed into a token budget: the budget is water-filled over the ranked
+# documents, so short ones go in whole and long ones share what is left, and a
+# long document is cut down to its sentences with the most query terms (kept in
+# their original order). when even the smallest useful share per document does
+# not fit, the lowest-ranked documents are left out.
+#
+# tokens are counted with the target model's tokenizer (a tokenizer.json
+# through the `tokenizers` package). like the embedding model it is loaded from
+# the local cache under __models__ when it is there and downloaded into it
+# otherwise; a path to a tokenizer.json works too. until it is loaded, or when
+# loading fails (no network, no cache), a word-piece estimate is used.
+
+import os
+import re
+from typing import List, Optional, Sequence, Tuple
+
+from lexical_index import query_terms
+
+try:
+    from tokenizers import Tokenizer
+except ImportError:
+    Tokenizer = None
+
+try:
+    from huggingface_hub import hf_hub_download
+except ImportError:
+    hf_hub_download = None
+
+tokenizers_dir = "../__models__/tokenizers"
+
+SEPARATOR = "\n\n"
+ELLIPSIS = " ... "
+
+
+class TokenCounter:
+    def __init__(self):
+        self.name = "heuristic"
+        self._tokenizer = None
+
+    def load(self, tokenizer: Optional[str]) -> bool:
+        """Loads a tokenizer.json path or a huggingface model id. Counting stays heuristic if that fails."""
+        if not tokenizer:
+            return False
+        if Tokenizer is None:
+            print("Warning: `tokenizers` is not installed, context tokens are estimated")
+            return False
+        try:
+            if os.path.exists(tokenizer):
+                self._tokenizer = Tokenizer.from_file(tokenizer)
+            else:
+                self._tokenizer = Tokenizer.from_file(_hub_tokenizer(tokenizer))
+        except Exception as e:
+            print(f"Warning: could not load tokenizer {tokenizer}, context tokens are estimated: {e}")
+            return False
+        self.name = tokenizer
+        return True
+
+    def count(self, text: str) -> int:
+        if not text:
+            return 0
+        if self._tokenizer is not None:
+            return len(self._tokenizer.encode(text, add_special_tokens=False).ids)
+        # bpe vocabularies keep common words whole and split long ones into
+        # pieces of about four characters; punctuation is a token of its own
+        return sum(1 + (len(piece) - 1) // 4 for piece in re.findall(r"\w+|[^\w\s]", text))
+
+
+def _hub_tokenizer(model_id: str) -> str:
+    """Path of a hub model's tokenizer.json, from the local cache when it is there."""
+    if hf_hub_download is None:
+        raise RuntimeError("`huggingface_hub` is not installed, give CONTEXT_TOKENIZER a tokenizer.json path")
+    try:
+        path = hf_hub_download(model_id, "tokenizer.json", cache_dir=tokenizers_dir, local_files_only=True)
+        print(f"✅ Loading tokenizer {model_id} from local cache...")
+        return path
+    except Exception:
+        print(f"🌐 Downloading tokenizer {model_id} from Hugging Face...")
+        return hf_hub_download(model_id, "tokenizer.json", cache_dir=tokenizers_dir)
+
+
+def _sentences(text: str) -> List[str]:
+    return [s for s in re.split(r"(?<=[.!?])\s+|\n+", text) if s.strip()]
+
+
+def _fill_level(sizes: Sequence[int], budget: int) -> int:
+    """Largest cap c with sum(min(size, c)) <= budget."""
+    low, high = 0, max(sizes, default=0)
+    while low < high:
+        mid = (low + high + 1) // 2
+        if sum(min(size, mid) for size in sizes) <= budget:
+            low = mid
+        else:
+            high = mid - 1
+    return low
+
+
+def trim_document(text: str, terms: Sequence[str], budget: int, counter: TokenCounter) -> str:
+    """
+    The sentences of text with the most query terms that fit in budget tokens, in
+    text order; the leading sentences when none has a query term.
+    """
+    sentences = _sentences(text)
+    wanted = set(terms)
+    hits = [len(wanted & set(re.findall(r"\w+", sentence.lower()))) for sentence in sentences]
+    scored = sorted(range(len(sentences)), key=lambda i: (-hits[i], i))
+    if any(hits):
+        # only the matching sentences, filler would just cost prompt time
+        scored = [i for i in scored if hits[i]]
+    picked, used = [], 0
+    gap = counter.count(ELLIPSIS)
+    for i in scored:
+        cost = counter.count(sentences[i]) + (gap if picked else 0)
+        if used + cost <= budget:
+            picked.append(i)
+            used += cost
+    if not picked and sentences:
+        # a single sentence longer than the budget: its leading words
+        words = sentences[scored[0]].split()
+        low, high = 0, len(words)
+        while low < high:
+            mid = (low + high + 1) // 2
+            if counter.count(" ".join(words[:mid])) <= budget:
+                low = mid
+            else:
+                high = mid - 1
+        return " ".join(words[:low])
+    picked.sort()
+    parts = []
+    for n, i in enumerate(picked):
+        if n and i != picked[n - 1] + 1:
+            parts.append(ELLIPSIS.strip())
+        parts.append(sentences[i])
+    return " ".join(parts)
+
+
+def build_context(
+    query: str,
+    documents: Sequence[str],
+    budget: int,
+    counter: TokenCounter,
+    min_share: int = 48,
+) -> Tuple[str, int, List[int]]:
+    """
+    Packs ranked documents (best first) into budget tokens.
+    Returns (context, tokens used, indexes of the documents that made it in).
+    """
+    sizes = [counter.count(doc) for doc in documents]
+    separator = counter.count(SEPARATOR)
+    kept = list(range(len(documents)))
+    while kept:
+        room = budget - separator * (len(kept) - 1)
+        level = _fill_level([sizes[i] for i in kept], room)
+        if level >= min(min_share, max(sizes[i] for i in kept)) or len(kept) == 1:
+            break
+        kept.pop()  # too crowded, drop the lowest-ranked document
+    if not kept:
+        return "", 0, []
+
+    terms = query_terms(query)
+    parts, used = [], []
+    for i in kept:
+        doc = documents[i] if sizes[i] <= level else trim_document(documents[i], terms, level, counter)
+        if doc:
+            parts.append(doc)
+            used.append(i)
+    context = SEPARATOR.join(parts)
+    return context, counter.count(context), used
@@ -0,0 +1,243 @@
+# -- embedding backends --
+#
+# "torch" is the original sentence-transformers model. "onnx" runs the same
+# all-mpnet-base-v2 weights exported to ONNX through onnxruntime (optionally
+# int8 dynamically quantized), so the serving path never imports torch.
+#
+# export / quantize / parity check from the command line (inside /server):
+#   python embedding_backends.py export --quantize
+#   python embedding_backends.py quantize   (int8 from an existing export)
+#   python embedding_backends.py parity --quantize
+# quantizing needs the onnx package (pip install onnx), serving does not.
+
+import argparse
+import json
+import os
+from typing import List, Optional
+
+import numpy as np
+
+
+model_name = "all-mpnet-base-v2"
+models_dir = "../__models__/embedding-model"
+local_snapshot = f"{models_dir}/models--sentence-transformers--all-mpnet-base-v2/snapshots/e8c3b32edf5434bc2275fc9bab85f82640a19130"
+onnx_dir = f"{models_dir}/onnx"
+
+
+def backend_model_id(name: str, quantized: bool = False) -> str:
+    """Identifies the vectors a backend produces (used as the embedding cache key)."""
+    if name == "onnx":
+        return f"{model_name}:onnx-int8" if quantized else f"{model_name}:onnx"
+    return model_name
+
+
+def load_sentence_transformer(threads: int = 0):
+    from sentence_transformers import SentenceTransformer
+
+    if threads:
+        import torch
+
+        torch.set_num_threads(threads)
+
+    if os.path.exists(local_snapshot):
+        print("✅ Loading model from local cache...")
+        return SentenceTransformer(local_snapshot)
+    print("🌐 Downloading model from Hugging Face...")
+    return SentenceTransformer(model_name, cache_folder=models_dir)
+
+
+class TorchBackend:
+    """The original sentence-transformers (PyTorch) model."""
+
+    name = "torch"
+
+    def __init__(self, threads: int = 0):
+        self.model = load_sentence_transformer(threads)
+        self.dim = self.model.get_sentence_embedding_dimension()
+
+    @property
+    def model_id(self) -> str:
+        return backend_model_id(self.name)
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        return self.model.encode(texts)
+
+
+class OnnxBackend:
+    """all-mpnet-base-v2 exported to ONNX and run through onnxruntime (mean pooling + normalize)."""
+
+    name = "onnx"
+
+    def __init__(self, path: str = onnx_dir, quantized: bool = False, threads: int = 0):
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+
+        with open(os.path.join(path, "onnx_config.json")) as f:
+            self.config = json.load(f)
+        self.quantized = quantized
+        self.dim = self.config["dim"]
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads:
+            options.intra_op_num_threads = threads
+            options.inter_op_num_threads = 1
+        model_file = "model.int8.onnx" if quantized else "model.onnx"
+        self.session = ort.InferenceSession(
+            os.path.join(path, model_file),
+            sess_options=options,
+            providers=["CPUExecutionProvider"],
+        )
+
+        self.tokenizer = Tokenizer.from_file(os.path.join(path, "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length=self.config["max_seq_length"])
+        pad_token = self.config["pad_token"]
+        self.tokenizer.enable_padding(pad_id=self.tokenizer.token_to_id(pad_token), pad_token=pad_token)
+
+    @property
+    def model_id(self) -> str:
+        return backend_model_id(self.name, self.quantized)
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        if isinstance(texts, str):
+            return self.encode([texts])[0]
+        encodings = self.tokenizer.encode_batch(texts)
+        input_ids = np.array([e.ids for e in encodings], dtype=np.int64)
+        attention_mask = np.array([e.attention_mask for e in encodings], dtype=np.int64)
+        (hidden,) = self.session.run(
+            ["last_hidden_state"],
+            {"input_ids": input_ids, "attention_mask": attention_mask},
+        )
+
+        # -- mean pooling over real tokens, same as the sentence-transformers Pooling module --
+        mask = attention_mask[..., None].astype(np.float32)
+        pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        if self.config.get("normalize", True):
+            pooled /= np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+        return pooled.astype(np.float32)
+
+
+def export_onnx(path: str = onnx_dir, quantize: bool = False) -> None:
+    """One-off export of the sentence-transformers model to ONNX. Needs torch, the serving path does not."""
+    import torch
+    from sentence_transformers.models import Normalize
+
+    os.makedirs(path, exist_ok=True)
+    st = load_sentence_transformer()
+    transformer = st[0].auto_model.eval()
+
+    class _Encoder(torch.nn.Module):
+        def __init__(self, inner):
+            super().__init__()
+            self.inner = inner
+
+        def forward(self, input_ids, attention_mask):
+            return self.inner(input_ids=input_ids, attention_mask=attention_mask).last_hidden_state
+
+    dummy = st.tokenizer(["export"], return_tensors="pt")
+    print("Exporting embedding model to ONNX...")
+    torch.onnx.export(
+        _Encoder(transformer),
+        (dummy["input_ids"], dummy["attention_mask"]),
+        os.path.join(path, "model.onnx"),
+        input_names=["input_ids", "attention_mask"],
+        output_names=["last_hidden_state"],
+        dynamic_axes={
+            "input_ids": {0: "batch", 1: "sequence"},
+            "attention_mask": {0: "batch", 1: "sequence"},
+            "last_hidden_state": {0: "batch", 1: "sequence"},
+        },
+        opset_version=14,
+    )
+
+    st.tokenizer.save_pretrained(path)
+    with open(os.path.join(path, "onnx_config.json"), "w") as f:
+        json.dump(
+            {
+                "model": model_name,
+                "dim": st.get_sentence_embedding_dimension(),
+                "max_seq_length": st.max_seq_length,
+                "pad_token": st.tokenizer.pad_token,
+                "normalize": any(isinstance(m, Normalize) for m in st),
+            },
+            f,
+            indent=2,
+        )
+
+    if quantize:
+        quantize_onnx(path)
+    print(f"ONNX model written to {path}")
+
+
+def quantize_onnx(path: str = onnx_dir) -> None:
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    print("Quantizing ONNX model to int8...")
+    quantize_dynamic(
+        os.path.join(path, "model.onnx"),
+        os.path.join(path, "model.int8.onnx"),
+        weight_type=QuantType.QInt8,
+    )
+
+
+def load_backend(name: str = "torch", quantized: bool = False, threads: int = 0):
+    """Returns an object with .encode(list[str]), .dim and .model_id for the selected backend."""
+    if name == "torch":
+        return TorchBackend(threads=threads)
+    if name == "onnx":
+        # exporting needs torch and quantizing needs the onnx package; neither
+        # is part of the serving environment, so both are command line steps
+        model_file = "model.int8.onnx" if quantized else "model.onnx"
+        if not os.path.exists(os.path.join(onnx_dir, "onnx_config.json")) or not os.path.exists(
+            os.path.join(onnx_dir, model_file)
+        ):
+            step = "quantize" if quantized and os.path.exists(os.path.join(onnx_dir, "model.onnx")) else "export"
+            raise FileNotFoundError(
+                f"No {model_file} in {onnx_dir}; run the {step} step first "
+                f"(inside /server: python embedding_backends.py {step}{' --quantize' if step == 'export' and quantized else ''})"
+            )
+        return OnnxBackend(onnx_dir, quantized=quantized, threads=threads)
+    raise ValueError(f"Unknown embedding backend: {name}")
+
+
+parity_texts = [
+    "Name: Wave Behavior. Light shows interference and diffraction patterns.",
+    "What is the Schrödinger equation?",
+    "Name: Photosynthesis. Plants turn light, water and carbon dioxide into glucose and oxygen.",
+    "short",
+    "Name: Fourier Transform. " + "Decomposes a signal into its frequency components. " * 40,
+]
+
+
+def parity_check(reference, candidate, texts: Optional[List[str]] = None) -> dict:
+    """Cosine agreement between two backends on the same texts."""
+    texts = texts or parity_texts
+    a = np.asarray(reference.encode(texts), dtype=np.float32)
+    b = np.asarray(candidate.encode(texts), dtype=np.float32)
+    if a.shape != b.shape:
+        raise ValueError(f"Dimension mismatch: {a.shape} vs {b.shape}")
+    cosine = (a * b).sum(axis=1) / (np.linalg.norm(a, axis=1) * np.linalg.norm(b, axis=1))
+    return {
+        "reference": reference.model_id,
+        "candidate": candidate.model_id,
+        "dim": int(a.shape[1]),
+        "texts": len(texts),
+        "min_cosine": float(cosine.min()),
+        "mean_cosine": float(cosine.mean()),
+        "max_cosine_difference": float(1 - cosine.min()),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Embedding backend tools")
+    parser.add_argument("command", choices=["export", "quantize", "parity"])
+    parser.add_argument("--quantize", action="store_true", help="use / produce the int8 model")
+    args = parser.parse_args()
+
+    if args.command == "export":
+        export_onnx(onnx_dir, quantize=args.quantize)
+    elif args.command == "quantize":
+        quantize_onnx(onnx_dir)
+    else:
+        report = parity_check(load_backend("torch"), load_backend("onnx", quantized=args.quantize))
+        print(json.dumps(report, indent=2))
@@ -0,0 +1,150 @@
+# -- micro-batching scheduler for the embedding model --
+#
+# every /nodes/insert, /nodes/update and /query/stream used to run its own
+# single-sentence model.encode(). this collects whatever requests arrive within
+# a few milliseconds (or until max_batch_size is reached) and runs them through
+# one batched encode call, then hands each caller back its own vector.
+
+import asyncio
+import time
+from typing import Callable, List, Optional, Sequence
+
+
+class EmbeddingBatcher:
+    """
+    Batches concurrent embedding requests into one encode call.
+
+    encode_fn is a blocking function taking a list of texts and returning one
+    vector per text; it is run in a worker thread so the event loop stays free.
+    """
+
+    def __init__(
+        self,
+        encode_fn: Callable[[List[str]], Sequence],
+        max_batch_size: int = 32,
+        max_wait_ms: float = 5.0,
+    ):
+        self.encode_fn = encode_fn
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+
+        # -- stats --
+        self._requests = 0
+        self._batches = 0
+        self._batch_size_sum = 0
+        self._batch_size_max = 0
+        self._last_batch_size = 0
+        self._wait_sum = 0.0
+        self._wait_max = 0.0
+        self._encode_sum = 0.0
+
+    # -- lifecycle --
+
+    def _ensure_started(self):
+        # the queue and the worker have to live on the running loop, so they
+        # are created on first use instead of at import time
+        if self._worker is None or self._worker.done():
+            self._queue = asyncio.Queue()
+            self._worker = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+
+    # -- public api --
+
+    async def embed(self, text: str):
+        self._ensure_started()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((text, future, time.perf_counter()))
+        return await future
+
+    async def embed_many(self, texts: List[str]) -> list:
+        self._ensure_started()
+        loop = asyncio.get_running_loop()
+        futures = []
+        for text in texts:
+            future = loop.create_future()
+            await self._queue.put((text, future, time.perf_counter()))
+            futures.append(future)
+        return list(await asyncio.gather(*futures))
+
+    def stats(self) -> dict:
+        batches = self._batches or 1
+        requests = self._requests or 1
+        return {
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000,
+            "pending": self._queue.qsize() if self._queue is not None else 0,
+            "requests": self._requests,
+            "batches": self._batches,
+            "mean_batch_size": round(self._batch_size_sum / batches, 2),
+            "max_batch_size_seen": self._batch_size_max,
+            "last_batch_size": self._last_batch_size,
+            "mean_queue_wait_ms": round(self._wait_sum / requests * 1000, 3),
+            "max_queue_wait_ms": round(self._wait_max * 1000, 3),
+            "mean_encode_ms": round(self._encode_sum / batches * 1000, 3),
+        }
+
+    # -- worker --
+
+    async def _collect(self) -> list:
+        """Waits for the first request, then gathers more until the batch is full or the window closes."""
+        batch = [await self._queue.get()]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            # take whatever is already queued without waiting
+            try:
+                batch.append(self._queue.get_nowait())
+                continue
+            except asyncio.QueueEmpty:
+                pass
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        while True:
+            batch = await self._collect()
+            # callers that gave up (cancelled request) do not need a vector
+            batch = [item for item in batch if not item[1].done()]
+            if not batch:
+                continue
+
+            started = time.perf_counter()
+            for _, _, enqueued in batch:
+                wait = started - enqueued
+                self._wait_sum += wait
+                self._wait_max = max(self._wait_max, wait)
+
+            texts = [text for text, _, _ in batch]
+            try:
+                vectors = await asyncio.to_thread(self.encode_fn, texts)
+            except Exception as e:
+                for _, future, _ in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            self._encode_sum += time.perf_counter() - started
+            self._requests += len(batch)
+            self._batches += 1
+            self._batch_size_sum += len(batch)
+            self._batch_size_max = max(self._batch_size_max, len(batch))
+            self._last_batch_size = len(batch)
+
+            for (_, future, _), vector in zip(batch, vectors):
+                if not future.done():
+                    future.set_result(vector)
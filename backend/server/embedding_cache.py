@@ -0,0 +1,110 @@
+# -- content-hash embedding cache --
+#
+# embeddings are keyed by (model id, sha256 of the exact input text). a bounded
+# in-memory LRU sits in front of a sqlite table so cached vectors survive
+# restarts and are shared by every worker on the host.
+
+import hashlib
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+import numpy as np
+
+
+class EmbeddingCache:
+    """Two tier (memory LRU + sqlite) cache of embedding vectors."""
+
+    def __init__(self, model_id: str, path: str = "embedding_cache.db", max_memory_items: int = 10000):
+        self.model_id = model_id
+        self.path = path
+        self.max_memory_items = max(0, int(max_memory_items))
+        self._memory: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS embeddings (
+                model_id  TEXT NOT NULL,
+                text_hash TEXT NOT NULL,
+                dim       INTEGER NOT NULL,
+                vector    BLOB NOT NULL,
+                PRIMARY KEY (model_id, text_hash)
+            ) WITHOUT ROWID
+            """
+        )
+
+        # -- stats --
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def text_hash(text: str) -> str:
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def get(self, text: str) -> Optional[np.ndarray]:
+        key = self.text_hash(text)
+        with self._lock:
+            vector = self._memory.get(key)
+            if vector is not None:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                return vector
+
+            row = self._db.execute(
+                "SELECT vector FROM embeddings WHERE model_id = ? AND text_hash = ?",
+                (self.model_id, key),
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+
+            vector = np.frombuffer(row[0], dtype=np.float32)
+            self._remember(key, vector)
+            self.disk_hits += 1
+            return vector
+
+    def put(self, text: str, vector) -> None:
+        key = self.text_hash(text)
+        vector = np.asarray(vector, dtype=np.float32)
+        with self._lock:
+            self._remember(key, vector)
+            self._db.execute(
+                "INSERT OR REPLACE INTO embeddings (model_id, text_hash, dim, vector) VALUES (?, ?, ?, ?)",
+                (self.model_id, key, int(vector.shape[-1]), vector.tobytes()),
+            )
+
+    def _remember(self, key: str, vector: np.ndarray) -> None:
+        if self.max_memory_items == 0:
+            return
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_items:
+            self._memory.popitem(last=False)
+
+    def stats(self) -> dict:
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        with self._lock:
+            disk_items = self._db.execute(
+                "SELECT COUNT(*) FROM embeddings WHERE model_id = ?", (self.model_id,)
+            ).fetchone()[0]
+            memory_items = len(self._memory)
+        return {
+            "model_id": self.model_id,
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": round((self.memory_hits + self.disk_hits) / lookups, 4) if lookups else 0.0,
+            "memory_items": memory_items,
+            "max_memory_items": self.max_memory_items,
+            "disk_items": disk_items,
+        }
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,300 @@
+# -- shared embedding sidecar --
+#
+# with `uvicorn server:app --workers N` every worker used to load its own copy
+# of the embedding model and its own thread pool. the sidecar is one local
+# process that owns the model and batches encode requests from all workers;
+# the workers only keep a thin client (EMBED_SIDECAR=<address>).
+#
+# run (inside /server, before uvicorn):
+#   python embedding_sidecar.py --address /tmp/wevn-embed.sock --threads 4
+# address is a unix socket path, or host:port where unix sockets are not
+# available (windows).
+#
+# wire format, both directions: >II (header length, body length), a json
+# header, then the body. responses carry the vectors as raw float32 in the body.
+
+import argparse
+import asyncio
+import itertools
+import os
+import struct
+import time
+from typing import List, Optional
+
+import numpy as np
+import orjson
+
+from embedding_backends import load_backend
+from embedding_batcher import EmbeddingBatcher
+
+
+_frame_header = struct.Struct(">II")
+
+
+async def _read_frame(reader: asyncio.StreamReader):
+    header_len, body_len = _frame_header.unpack(await reader.readexactly(_frame_header.size))
+    header = orjson.loads(await reader.readexactly(header_len))
+    body = await reader.readexactly(body_len) if body_len else b""
+    return header, body
+
+
+def _frame(header: dict, body: bytes = b"") -> bytes:
+    header_bytes = orjson.dumps(header)
+    return _frame_header.pack(len(header_bytes), len(body)) + header_bytes + body
+
+
+def _split_address(address: str):
+    """host:port -> tcp, anything else is a unix socket path."""
+    host, sep, port = address.rpartition(":")
+    if sep and port.isdigit() and "/" not in address:
+        return host or "127.0.0.1", int(port)
+    return None, address
+
+
+# -- server side --
+
+
+class EmbeddingSidecar:
+    def __init__(self, backend, batcher: EmbeddingBatcher):
+        self.backend = backend
+        self.batcher = batcher
+        self.connections = 0
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.connections += 1
+        write_lock = asyncio.Lock()
+        tasks = set()
+
+        async def respond(header: dict):
+            request_id = header.get("id")
+            try:
+                if header.get("op") == "info":
+                    reply, body = {"id": request_id, "model_id": self.backend.model_id, "dim": self.backend.dim}, b""
+                elif header.get("op") == "stats":
+                    reply, body = {"id": request_id, "stats": self.stats()}, b""
+                else:
+                    vectors = await self.batcher.embed_many(header["texts"])
+                    matrix = np.asarray(vectors, dtype=np.float32).reshape(len(vectors), -1)
+                    reply, body = {"id": request_id, "count": matrix.shape[0], "dim": matrix.shape[1]}, matrix.tobytes()
+            except Exception as e:
+                reply, body = {"id": request_id, "error": str(e)}, b""
+            async with write_lock:
+                writer.write(_frame(reply, body))
+                await writer.drain()
+
+        try:
+            while True:
+                header, _ = await _read_frame(reader)
+                # requests on one connection are served concurrently so they can share a batch
+                task = asyncio.create_task(respond(header))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self.connections -= 1
+            for task in tasks:
+                task.cancel()
+            writer.close()
+
+    def stats(self) -> dict:
+        return {
+            "model_id": self.backend.model_id,
+            "pid": os.getpid(),
+            "connections": self.connections,
+            "scheduler": self.batcher.stats(),
+        }
+
+
+async def serve(address: str, backend_name: str, quantized: bool, threads: int, max_batch_size: int, max_wait_ms: float):
+    print(f"Loading embedding backend '{backend_name}' for the sidecar...")
+    backend = await asyncio.to_thread(lambda: load_backend(backend_name, quantized=quantized, threads=threads))
+    sidecar = EmbeddingSidecar(backend, EmbeddingBatcher(backend.encode, max_batch_size, max_wait_ms))
+
+    host, target = _split_address(address)
+    if host is None:
+        if os.path.exists(target):
+            os.remove(target)  # stale socket from a previous run
+        server = await asyncio.start_unix_server(sidecar.handle, path=target)
+    else:
+        server = await asyncio.start_server(sidecar.handle, host=host, port=target)
+    print(f"✅ Embedding sidecar ({backend.model_id}) listening on {address}")
+    async with server:
+        await server.serve_forever()
+
+
+# -- client side (used by each uvicorn worker) --
+
+
+class SidecarClient:
+    """
+    Thin async client for the sidecar. Exposes the same embed / embed_many /
+    stats / stop interface as EmbeddingBatcher so server.py can use either.
+    """
+
+    def __init__(
+        self,
+        address: str,
+        expected_model_id: Optional[str] = None,
+        retry_interval: float = 0.5,
+        connect_timeout: float = 30.0,
+        cooldown: float = 10.0,
+    ):
+        self.address = address
+        self.expected_model_id = expected_model_id
+        self.retry_interval = retry_interval
+        self.connect_timeout = connect_timeout
+        self.cooldown = cooldown
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._reader_task: Optional[asyncio.Task] = None
+        self._connect_lock: Optional[asyncio.Lock] = None
+        self._connect_error: Optional[Exception] = None
+        self._retry_at = 0.0
+        self._pending = {}
+        self._ids = itertools.count()
+
+        # -- stats --
+        self._requests = 0
+        self._texts = 0
+        self._round_trip_sum = 0.0
+        self._reconnects = 0
+        self._connect_failures = 0
+
+    async def _connect(self) -> asyncio.StreamWriter:
+        """The open connection's writer, connecting first if needed. Raises ConnectionError when the sidecar can't be reached."""
+        if self._connect_lock is None:
+            self._connect_lock = asyncio.Lock()
+        async with self._connect_lock:
+            writer = self._writer
+            if writer is not None and not writer.is_closing():
+                return writer
+            if self._connect_error is not None and time.monotonic() < self._retry_at:
+                # circuit open: the sidecar was just found down, fail right away
+                raise self._connect_error
+            host, target = _split_address(self.address)
+            # the full timeout is for a sidecar that may still be loading; once it
+            # was found down, a single attempt per cooldown checks whether it is back
+            deadline = time.monotonic() + (0.0 if self._connect_error is not None else self.connect_timeout)
+            while True:
+                try:
+                    if host is None:
+                        reader, writer = await asyncio.open_unix_connection(target)
+                    else:
+                        reader, writer = await asyncio.open_connection(host, target)
+                    break
+                except OSError as e:
+                    now = time.monotonic()
+                    if now >= deadline:
+                        self._connect_failures += 1
+                        self._retry_at = now + self.cooldown
+                        self._connect_error = ConnectionError(f"Embedding sidecar at {self.address} not reachable: {e}")
+                        raise self._connect_error
+                    await asyncio.sleep(min(self.retry_interval, deadline - now))
+            self._connect_error = None
+            self._reader, self._writer = reader, writer
+            self._reconnects += 1
+            self._reader_task = asyncio.create_task(self._read_loop(reader, writer))
+
+            if self.expected_model_id is not None:
+                info, _ = await self._request({"op": "info"}, writer=writer)
+                if info["model_id"] != self.expected_model_id:
+                    writer.close()
+                    self._writer = None
+                    raise RuntimeError(
+                        f"Embedding sidecar serves {info['model_id']}, this worker expects {self.expected_model_id}"
+                    )
+            return writer
+
+    async def _read_loop(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                header, body = await _read_frame(reader)
+                future = self._pending.pop(header.get("id"), None)
+                if future is not None and not future.done():
+                    future.set_result((header, body))
+        except (asyncio.IncompleteReadError, ConnectionError) as e:
+            error = e
+        except asyncio.CancelledError:
+            error = ConnectionError("Embedding sidecar client stopped")
+        # fail everything in flight, the next request reconnects
+        if self._writer is writer:
+            self._writer = None
+        for future in self._pending.values():
+            if not future.done():
+                future.set_exception(ConnectionError(f"Embedding sidecar connection lost: {error}"))
+        self._pending.clear()
+
+    async def _request(self, header: dict, writer: Optional[asyncio.StreamWriter] = None):
+        if writer is None:
+            writer = await self._connect()
+        request_id = next(self._ids)
+        future = asyncio.get_running_loop().create_future()
+        self._pending[request_id] = future
+        try:
+            writer.write(_frame({**header, "id": request_id}))
+            await writer.drain()
+        except (ConnectionError, RuntimeError) as e:
+            # closed between connecting and writing
+            self._pending.pop(request_id, None)
+            raise ConnectionError(f"Embedding sidecar connection lost: {e}") from e
+        reply, body = await future
+        if "error" in reply:
+            raise RuntimeError(f"Embedding sidecar error: {reply['error']}")
+        return reply, body
+
+    async def embed_many(self, texts: List[str]) -> list:
+        if not texts:
+            return []
+        started = time.perf_counter()
+        reply, body = await self._request({"op": "embed", "texts": list(texts)})
+        matrix = np.frombuffer(body, dtype=np.float32).reshape(reply["count"], reply["dim"])
+        self._requests += 1
+        self._texts += len(texts)
+        self._round_trip_sum += time.perf_counter() - started
+        return list(matrix)
+
+    async def embed(self, text: str):
+        return (await self.embed_many([text]))[0]
+
+    async def sidecar_stats(self) -> dict:
+        reply, _ = await self._request({"op": "stats"})
+        return reply["stats"]
+
+    def stats(self) -> dict:
+        requests = self._requests or 1
+        return {
+            "sidecar": self.address,
+            "connected": self._writer is not None and not self._writer.is_closing(),
+            "requests": self._requests,
+            "texts": self._texts,
+            "in_flight": len(self._pending),
+            "mean_round_trip_ms": round(self._round_trip_sum / requests * 1000, 3),
+            "connections_opened": self._reconnects,
+            "connect_failures": self._connect_failures,
+        }
+
+    async def stop(self):
+        if self._reader_task is not None:
+            self._reader_task.cancel()
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Shared embedding model process for all uvicorn workers")
+    parser.add_argument("--address", default=os.getenv("EMBED_SIDECAR", "/tmp/wevn-embed.sock"))
+    parser.add_argument("--backend", default=os.getenv("EMBED_BACKEND", "torch"))
+    parser.add_argument("--quantized", action="store_true", default=os.getenv("EMBED_QUANTIZED", "0") == "1")
+    parser.add_argument(
+        "--threads",
+        type=int,
+        default=int(os.getenv("EMBED_THREADS", "0")),
+        help="intra-op threads for the model (0 = library default)",
+    )
+    parser.add_argument("--max-batch-size", type=int, default=int(os.getenv("EMBED_MAX_BATCH_SIZE", "64")))
+    parser.add_argument("--max-wait-ms", type=float, default=float(os.getenv("EMBED_MAX_WAIT_MS", "5")))
+    args = parser.parse_args()
+
+    asyncio.run(serve(args.address, args.backend, args.quantized, args.threads, args.max_batch_size, args.max_wait_ms))
@@ -0,0 +1,78 @@
+# -- cluster summary of a collection --
+#
+# zoomed out, a 50k-node domain is better shown as a few hundred clusters than
+# as every node. nodes are grouped by k-means over the embeddings chroma
+# already stores. each cluster is labelled with the node closest to its
+# centroid, and the links between members of two clusters add up to the
+# weight of the edge between them.
+
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from graph_links import kmeans
+
+
+def default_cluster_count(n: int) -> int:
+    """sqrt(n / 2) clusters, the usual rule of thumb, kept between 1 and 256."""
+    return int(max(1, min(256, round((n / 2) ** 0.5))))
+
+
+def cluster_graph(
+    ids: Sequence[str],
+    embeddings,
+    names: Sequence[str],
+    edges: Iterable[Tuple[str, str]],
+    k: int,
+    init: Optional[np.ndarray] = None,
+) -> dict:
+    """
+    {"clusters": [...], "edges": [...], "centroids": array, "assignment": {node_id: cluster}}.
+    init is the previous run's centroids, so cluster numbers stay stable across versions.
+    """
+    ids = list(ids)
+    if not ids:
+        return {"clusters": [], "edges": [], "centroids": None, "assignment": {}}
+    matrix = np.asarray(embeddings, dtype=np.float32)
+    centroids, assignment = kmeans(matrix, k, init=init)
+
+    # label: the member nearest its centroid
+    distances = ((matrix - centroids[assignment]) ** 2).sum(axis=1)
+    order = np.lexsort((distances, assignment))
+    first = order[np.r_[True, assignment[order][1:] != assignment[order][:-1]]]
+    nearest = np.full(len(centroids), -1, dtype=np.int64)
+    nearest[assignment[first]] = first
+    sizes = np.bincount(assignment, minlength=len(centroids))
+
+    # every link (user or semantic, either direction) adds 1 to its cluster pair
+    index = {node_id: i for i, node_id in enumerate(ids)}
+    weights: Dict[Tuple[int, int], int] = {}
+    internal = np.zeros(len(centroids), dtype=np.int64)
+    for src, dst in edges:
+        i, j = index.get(src), index.get(dst)
+        if i is None or j is None:
+            continue
+        a, b = int(assignment[i]), int(assignment[j])
+        if a == b:
+            internal[a] += 1
+        else:
+            pair = (a, b) if a < b else (b, a)
+            weights[pair] = weights.get(pair, 0) + 1
+
+    clusters: List[dict] = [
+        {
+            "cluster": c,
+            "size": int(sizes[c]),
+            "label": names[nearest[c]],
+            "label_node_id": ids[nearest[c]],
+            "internal_links": int(internal[c]),
+        }
+        for c in range(len(centroids))
+        if sizes[c] > 0
+    ]
+    return {
+        "clusters": clusters,
+        "edges": [{"source": a, "target": b, "weight": w} for (a, b), w in sorted(weights.items())],
+        "centroids": centroids,
+        "assignment": {node_id: int(c) for node_id, c in zip(ids, assignment)},
+    }
@@ -0,0 +1,208 @@
+# -- server-side graph layout --
+#
+# the browser used to run a force simulation over every node after each
+# reload. positions are now computed here from the link graph, once per
+# collection version, and sent along with the nodes.
+#
+# a full layout starts from a spectral embedding of the graph (power iteration
+# on the random-walk matrix, so it stays O(edges) per step) and is refined by a
+# vectorized fruchterman-reingold force layout. repulsion is exact for small
+# graphs and goes through grid cell centers of mass for big ones. after a small
+# change only the touched nodes and their neighbors move, so the picture the
+# user has in front of them stays put.
+
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+
+# exact all-pairs repulsion up to this many nodes, grid cells above
+exact_repulsion_below = 3000
+# an update touching more than this share of the nodes (and more than
+# incremental_min of them) gets a full layout
+incremental_share = 0.1
+incremental_min = 25
+
+
+def spectral_init(n: int, src: np.ndarray, dst: np.ndarray, dim: int, iterations: int = 60, seed: int = 0) -> np.ndarray:
+    """Leading non-trivial eigenvectors of the random-walk matrix, scaled to [-1, 1]."""
+    rng = np.random.default_rng(seed)
+    pos = rng.uniform(-1.0, 1.0, size=(n, dim))
+    if n <= dim + 1 or len(src) == 0:
+        return pos
+    degree = np.bincount(src, minlength=n) + np.bincount(dst, minlength=n)
+    connected = degree > 0
+    inv_degree = 1.0 / np.maximum(degree, 1)
+    x = pos.copy()
+    for _ in range(iterations):
+        walked = _scatter_add(n, src, x[dst]) + _scatter_add(n, dst, x[src])
+        # lazy walk, so the iteration converges instead of oscillating
+        x = 0.5 * (x + walked * inv_degree[:, None])
+        # drop the constant eigenvector, keep the rest orthonormal
+        x -= x[connected].mean(axis=0)
+        x, _ = np.linalg.qr(x)
+    pos[connected] = _unit_box(x[connected])
+    # nodes with the same neighbors land on the same spot, nudge them apart
+    return pos + rng.normal(scale=1e-3, size=pos.shape)
+
+
+def force_layout(
+    pos: np.ndarray,
+    src: np.ndarray,
+    dst: np.ndarray,
+    iterations: int = 100,
+    temperature: float = 0.1,
+    movable: Optional[np.ndarray] = None,
+    gravity: float = 0.05,
+) -> np.ndarray:
+    """Fruchterman-Reingold steps on pos (n, dim). Only rows in movable (bool mask) move."""
+    pos = np.array(pos, dtype=np.float64)
+    n, dim = pos.shape
+    if n < 2:
+        return pos
+    k = (4.0 / n) ** (1.0 / dim)  # ideal edge length in the [-1, 1] box
+    cooling = (0.01 / temperature) ** (1.0 / max(iterations, 1)) if temperature > 0.01 else 1.0
+    t = temperature
+    rows = np.arange(n) if movable is None else np.flatnonzero(movable)
+    if movable is not None:
+        # only edges that pull on a moving node matter
+        keep = movable[src] | movable[dst]
+        src, dst = src[keep], dst[keep]
+    for _ in range(iterations):
+        disp = np.zeros_like(pos)
+        if n <= exact_repulsion_below:
+            disp[rows] = _exact_repulsion(pos[rows], pos, k)
+        else:
+            disp[rows] = _grid_repulsion(pos[rows], pos, k)
+        if len(src):
+            delta = pos[src] - pos[dst]
+            length = np.maximum(np.linalg.norm(delta, axis=1, keepdims=True), 1e-9)
+            pull = delta * (length / k)  # |f| = d^2 / k
+            disp += _scatter_add(n, dst, pull) - _scatter_add(n, src, pull)
+        disp -= gravity * pos / k  # keeps loose components from drifting off
+        length = np.maximum(np.linalg.norm(disp, axis=1, keepdims=True), 1e-9)
+        step = disp / length * np.minimum(length, t)
+        pos[rows] += step[rows]
+        t *= cooling
+    return pos
+
+
+def _scatter_add(n: int, index: np.ndarray, values: np.ndarray) -> np.ndarray:
+    """Sums values rows into an (n, dim) array by index (np.add.at, but much faster)."""
+    return np.stack([np.bincount(index, weights=values[:, d], minlength=n) for d in range(values.shape[1])], axis=1)
+
+
+def _repulsion(points: np.ndarray, sources: np.ndarray, mass: Optional[np.ndarray], k: float, block_size: int = 1024) -> np.ndarray:
+    """
+    sum_j k^2 m_j (p - s_j) / |p - s_j|^2 for every point, written as matrix
+    products so no (points, sources, dim) array is built. coincident pairs
+    (a point and itself) are skipped.
+    """
+    disp = np.zeros_like(points)
+    source_norms = (sources * sources).sum(axis=1)
+    for start in range(0, len(points), block_size):
+        block = points[start : start + block_size]
+        d2 = (block * block).sum(axis=1)[:, None] - 2.0 * (block @ sources.T) + source_norms[None, :]
+        weight = np.where(d2 > 1e-12, 1.0 / np.maximum(d2, 1e-12), 0.0)
+        if mass is not None:
+            weight *= mass[None, :]
+        disp[start : start + block_size] = k * k * (block * weight.sum(axis=1)[:, None] - weight @ sources)
+    return disp
+
+
+def _exact_repulsion(points: np.ndarray, pos: np.ndarray, k: float) -> np.ndarray:
+    return _repulsion(points, pos, None, k)
+
+
+def _grid_repulsion(points: np.ndarray, pos: np.ndarray, k: float, max_cells: int = 1024) -> np.ndarray:
+    """Repulsion on points from the centers of mass of grid cells instead of from every node."""
+    n, dim = pos.shape
+    per_axis = max(2, int(round(min(max_cells, n) ** (1.0 / dim))))
+    low = pos.min(axis=0)
+    span = np.maximum(pos.max(axis=0) - low, 1e-9)
+    cell = np.minimum(((pos - low) / span * per_axis).astype(np.int64), per_axis - 1)
+    flat = np.ravel_multi_index(cell.T, (per_axis,) * dim)
+    mass = np.bincount(flat, minlength=per_axis**dim).astype(np.float64)
+    sums = np.stack([np.bincount(flat, weights=pos[:, d], minlength=per_axis**dim) for d in range(dim)], axis=1)
+    used = mass > 0
+    cell_mass = mass[used]
+    cell_center = sums[used] / cell_mass[:, None]
+    return _repulsion(points, cell_center, cell_mass, k)
+
+
+def _unit_box(pos: np.ndarray) -> np.ndarray:
+    center = (pos.max(axis=0) + pos.min(axis=0)) / 2.0
+    scale = np.abs(pos - center).max()
+    return (pos - center) / scale if scale > 0 else pos - center
+
+
+def _edge_arrays(index: Dict[str, int], edges: Iterable[Tuple[str, str]]) -> Tuple[np.ndarray, np.ndarray]:
+    """Undirected, de-duplicated edge endpoints as index arrays (edges to unknown nodes are skipped)."""
+    pairs = set()
+    for a, b in edges:
+        i, j = index.get(a), index.get(b)
+        if i is None or j is None or i == j:
+            continue
+        pairs.add((i, j) if i < j else (j, i))
+    if not pairs:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    arr = np.array(sorted(pairs), dtype=np.int64)
+    return arr[:, 0], arr[:, 1]
+
+
+def compute_layout(
+    ids: Sequence[str],
+    edges: Iterable[Tuple[str, str]],
+    dim: int = 2,
+    previous: Optional[Dict[str, List[float]]] = None,
+    changed: Optional[Iterable[str]] = None,
+    seed: int = 0,
+) -> Tuple[Dict[str, List[float]], str]:
+    """
+    {node_id: [x, y(, z)]} in roughly [-1, 1], plus "full" or "incremental".
+    With the previous positions and the ids changed since, only the changed
+    nodes, new nodes and their neighbors are moved.
+    """
+    ids = list(ids)
+    n = len(ids)
+    index = {node_id: i for i, node_id in enumerate(ids)}
+    src, dst = _edge_arrays(index, edges)
+
+    touched = None
+    if previous is not None and changed is not None:
+        touched = np.zeros(n, dtype=bool)
+        for node_id in changed:
+            if node_id in index:
+                touched[index[node_id]] = True
+        for node_id, i in index.items():
+            if node_id not in previous or len(previous[node_id]) != dim:
+                touched[i] = True
+        if touched.sum() > max(incremental_share * n, incremental_min):
+            touched = None
+
+    if touched is None:
+        pos = spectral_init(n, src, dst, dim, seed=seed)
+        pos = force_layout(pos, src, dst, iterations=100 if n <= 5000 else 50)
+        pos = _unit_box(pos) if n else pos
+        mode = "full"
+    else:
+        # neighbors of touched nodes may settle too
+        movable = touched.copy()
+        movable[dst[touched[src]]] = True
+        movable[src[touched[dst]]] = True
+        pos = np.zeros((n, dim))
+        rng = np.random.default_rng(seed)
+        known = ~touched
+        for node_id, i in index.items():
+            if known[i]:
+                pos[i] = previous[node_id]
+        # new / moved nodes start at the mean of their placed neighbors
+        for i in np.flatnonzero(touched):
+            around = np.concatenate([dst[src == i], src[dst == i]])
+            around = around[known[around]]
+            start = pos[around].mean(axis=0) if len(around) else np.zeros(dim)
+            pos[i] = start + rng.normal(scale=0.02, size=dim)
+        pos = force_layout(pos, src, dst, iterations=40, temperature=0.05, movable=movable)
+        mode = "incremental"
+
+    return {node_id: [round(float(v), 4) for v in pos[i]] for node_id, i in index.items()}, mode
@@ -0,0 +1,369 @@
+# -- vectorized semantic link computation --
+#
+# semantic links (s_links) are the max_links nearest nodes under
+# distance_threshold, returned as (id, distance) pairs nearest first so the
+# distance can be stored on the edge. these helpers compute them with numpy instead of one
+# collection.query per node. distances follow the collection's hnsw:space so
+# they line up with what chroma's own query returns (l2 is *squared* l2).
+
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+
+class LinkComputationCancelled(Exception):
+    pass
+
+
+# bytes held per (row, candidate) cell while a block is processed: the float32
+# distances, the matmul and norm temporaries, and argpartition's int64 indexes
+BYTES_PER_CELL = 20
+DEFAULT_MEMORY_BUDGET = 1 << 30
+
+
+def plan_blocks(width: int, memory_budget: int, workers: Optional[int], max_rows: int = 1024, min_rows: int = 64):
+    """
+    (rows per block, workers) so that workers blocks of rows x width cells stay
+    within memory_budget bytes. Threads are dropped before blocks get smaller
+    than min_rows; one thread always runs, with at least one row.
+    """
+    workers = max(1, workers or os.cpu_count() or 1)
+    row_bytes = max(1, width) * BYTES_PER_CELL
+    workers = max(1, min(workers, memory_budget // (min_rows * row_bytes)))
+    rows = max(1, min(max_rows, memory_budget // (workers * row_bytes)))
+    return rows, workers
+
+
+def collection_space(collection) -> str:
+    metadata = collection.metadata or {}
+    return metadata.get("hnsw:space", "l2")
+
+
+def pairwise_distances(queries: np.ndarray, base: np.ndarray, space: str = "l2") -> np.ndarray:
+    """(len(queries), len(base)) distance matrix in the given chroma space."""
+    queries = np.asarray(queries, dtype=np.float32)
+    base = np.asarray(base, dtype=np.float32)
+    if space == "cosine":
+        q = queries / np.clip(np.linalg.norm(queries, axis=1, keepdims=True), 1e-12, None)
+        b = base / np.clip(np.linalg.norm(base, axis=1, keepdims=True), 1e-12, None)
+        return 1.0 - q @ b.T
+    if space == "ip":
+        return 1.0 - queries @ base.T
+    # squared euclidean: |q|^2 - 2 q.b + |b|^2
+    distances = (queries * queries).sum(axis=1)[:, None] - 2.0 * (queries @ base.T) + (base * base).sum(axis=1)[None, :]
+    return np.maximum(distances, 0.0)
+
+
+def paired_distances(a: np.ndarray, b: np.ndarray, space: str = "l2") -> np.ndarray:
+    """Row-wise distance between a[i] and b[i] in the given chroma space."""
+    a = np.asarray(a, dtype=np.float32)
+    b = np.asarray(b, dtype=np.float32)
+    if space == "cosine":
+        a = a / np.clip(np.linalg.norm(a, axis=1, keepdims=True), 1e-12, None)
+        b = b / np.clip(np.linalg.norm(b, axis=1, keepdims=True), 1e-12, None)
+        return 1.0 - (a * b).sum(axis=1)
+    if space == "ip":
+        return 1.0 - (a * b).sum(axis=1)
+    return ((a - b) ** 2).sum(axis=1)
+
+
+def pick_links(
+    candidate_ids: Sequence[str],
+    candidate_distances: Sequence[float],
+    max_links: int,
+    distance_threshold: float,
+    exclude: Optional[str] = None,
+) -> List[Tuple[str, float]]:
+    """Closest max_links candidates under the threshold as (id, distance), nearest first."""
+    order = np.argsort(np.asarray(candidate_distances, dtype=np.float64), kind="stable")
+    links = []
+    seen = set()
+    for i in order[:max_links]:
+        node_id = candidate_ids[i]
+        if node_id == exclude or node_id in seen:
+            continue
+        if candidate_distances[i] <= distance_threshold:
+            links.append((node_id, float(candidate_distances[i])))
+            seen.add(node_id)
+    return links
+
+
+def batch_links(
+    batch_ids: List[str],
+    batch_embeddings: np.ndarray,
+    existing_ids: List[List[str]],
+    existing_distances: List[List[float]],
+    max_links: int,
+    distance_threshold: float,
+    space: str = "l2",
+) -> List[List[Tuple[str, float]]]:
+    """
+    Links for a batch of new nodes against the collection *and* each other.
+
+    existing_ids / existing_distances are the per-row results of one batched
+    collection.query over the batch (empty lists when the collection is empty).
+    """
+    batch_embeddings = np.asarray(batch_embeddings, dtype=np.float32)
+    within = pairwise_distances(batch_embeddings, batch_embeddings, space)
+    np.fill_diagonal(within, np.inf)
+
+    k = min(max_links, max(len(batch_ids) - 1, 0))
+    result = []
+    for row, node_id in enumerate(batch_ids):
+        # the node itself takes the first slot, like when querying the collection with it
+        ids = [node_id] + list(existing_ids[row])
+        distances = [0.0] + list(existing_distances[row])
+        if k:
+            nearest = np.argpartition(within[row], k - 1)[:k]
+            ids.extend(batch_ids[j] for j in nearest)
+            distances.extend(float(within[row, j]) for j in nearest)
+        result.append(pick_links(ids, distances, max_links, distance_threshold, exclude=node_id))
+    return result
+
+
+def knn_links(
+    ids: List[str],
+    embeddings,
+    max_links: int,
+    distance_threshold: float,
+    space: str = "l2",
+    block_size: int = 1024,
+    workers: Optional[int] = None,
+    progress: Optional[Callable[[int], None]] = None,
+    cancelled: Optional[Callable[[], bool]] = None,
+    memory_budget: int = DEFAULT_MEMORY_BUDGET,
+) -> List[List[Tuple[str, float]]]:
+    """
+    Exact all-pairs semantic links, same rule as querying the collection with
+    every node's embedding: take the max_links nearest (the node itself
+    included), drop the node itself and anything over the threshold.
+
+    Rows are processed in blocks (one matrix multiply + argpartition each)
+    spread over a thread pool; numpy releases the GIL inside the BLAS calls.
+    Block size and thread count are cut down so the blocks in flight fit in
+    memory_budget bytes (at most block_size rows each). progress(rows_done) is called after each block and cancelled() is checked
+    before each block starts.
+    """
+    matrix = np.asarray(embeddings, dtype=np.float32)
+    n = len(ids)
+    if n == 0:
+        return []
+    k = min(max_links, n)
+    if k <= 0:
+        return [[] for _ in ids]
+
+    block_size, workers = plan_blocks(n, memory_budget, workers, max_rows=block_size)
+    result: List[List[Tuple[str, float]]] = [[] for _ in ids]
+    done = 0
+    lock = threading.Lock()
+
+    def run_block(start: int):
+        nonlocal done
+        if cancelled is not None and cancelled():
+            raise LinkComputationCancelled()
+        stop = min(start + block_size, n)
+        distances = pairwise_distances(matrix[start:stop], matrix, space)
+        nearest = np.argpartition(distances, k - 1, axis=1)[:, :k]
+        nearest_distances = np.take_along_axis(distances, nearest, axis=1)
+        order = np.argsort(nearest_distances, axis=1, kind="stable")
+        nearest = np.take_along_axis(nearest, order, axis=1)
+        nearest_distances = np.take_along_axis(nearest_distances, order, axis=1)
+        for row in range(stop - start):
+            i = start + row
+            result[i] = [
+                (ids[j], float(d))
+                for j, d in zip(nearest[row], nearest_distances[row])
+                if j != i and d <= distance_threshold
+            ]
+        with lock:
+            done += stop - start
+            if progress is not None:
+                progress(done)
+
+    starts = range(0, n, block_size)
+    if workers == 1 or len(starts) == 1:
+        for start in starts:
+            run_block(start)
+    else:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for future in [pool.submit(run_block, start) for start in starts]:
+                future.result()
+    return result
+
+
+# -- approximate kNN graph (inverted file lists) --
+#
+# for very large collections even the blocked exact pass is O(N²). here the
+# embeddings are split into ~sqrt(N) k-means lists; the nodes of one list are
+# only compared against the members of the nprobe lists whose centroids are
+# closest to theirs. nprobe is the smallest value that reaches the recall
+# target on a random sample measured against the exact links.
+
+
+def kmeans(
+    matrix: np.ndarray,
+    k: int,
+    iterations: int = 10,
+    sample_size: int = 20000,
+    seed: int = 0,
+    init: Optional[np.ndarray] = None,
+):
+    """
+    Plain Lloyd's k-means (trained on a sample). Returns (centroids, assignment of every row).
+    init (k, dim) starts from given centroids, e.g. the previous run's, so cluster numbers stay put.
+    """
+    matrix = np.asarray(matrix, dtype=np.float32)
+    rng = np.random.default_rng(seed)
+    k = max(1, min(k, len(matrix)))
+    train = matrix[rng.choice(len(matrix), size=min(sample_size, len(matrix)), replace=False)]
+    if init is not None and len(init) == k:
+        centroids = np.array(init, dtype=np.float32)
+    else:
+        centroids = train[rng.choice(len(train), size=k, replace=False)].copy()
+
+    for _ in range(iterations):
+        labels = pairwise_distances(train, centroids, "l2").argmin(axis=1)
+        for c in range(k):
+            members = train[labels == c]
+            if len(members):
+                centroids[c] = members.mean(axis=0)
+            else:
+                # re-seed empty clusters
+                centroids[c] = train[rng.integers(len(train))]
+
+    assignment = np.empty(len(matrix), dtype=np.int64)
+    for start in range(0, len(matrix), 8192):
+        block = matrix[start : start + 8192]
+        assignment[start : start + len(block)] = pairwise_distances(block, centroids, "l2").argmin(axis=1)
+    return centroids, assignment
+
+
+def _links_against(rows, candidates, matrix, ids, k, distance_threshold, space, block_rows=1024):
+    """Refactor rule for the given rows, searching only the candidate rows, block_rows rows at a time."""
+    kk = min(k, len(candidates))
+    result = []
+    for start in range(0, len(rows), block_rows):
+        block = rows[start : start + block_rows]
+        distances = pairwise_distances(matrix[block], matrix[candidates], space)
+        nearest = np.argpartition(distances, kk - 1, axis=1)[:, :kk]
+        nearest_distances = np.take_along_axis(distances, nearest, axis=1)
+        del distances
+        order = np.argsort(nearest_distances, axis=1, kind="stable")
+        nearest = candidates[np.take_along_axis(nearest, order, axis=1)]
+        nearest_distances = np.take_along_axis(nearest_distances, order, axis=1)
+        result.extend(
+            [(ids[j], float(d)) for j, d in zip(nearest[r], nearest_distances[r]) if j != i and d <= distance_threshold]
+            for r, i in enumerate(block)
+        )
+    return result
+
+
+def link_recall(approx, exact) -> float:
+    """Share of the exact links (id, distance lists) that the approximate lists found."""
+    expected = sum(len(e) for e in exact)
+    if expected == 0:
+        return 1.0
+    found = sum(len({i for i, _ in a} & {i for i, _ in e}) for a, e in zip(approx, exact))
+    return found / expected
+
+
+def approx_knn_links(
+    ids: List[str],
+    embeddings,
+    max_links: int,
+    distance_threshold: float,
+    space: str = "l2",
+    recall_target: float = 0.95,
+    sample_size: int = 500,
+    workers: Optional[int] = None,
+    progress: Optional[Callable[[int], None]] = None,
+    cancelled: Optional[Callable[[], bool]] = None,
+    memory_budget: int = DEFAULT_MEMORY_BUDGET,
+):
+    """
+    Approximate version of knn_links. Returns (links, report) where the report
+    holds the list/probe settings and the recall measured on the sample.
+    Like knn_links, the blocks in flight are sized to fit in memory_budget bytes.
+    """
+    matrix = np.asarray(embeddings, dtype=np.float32)
+    n = len(ids)
+    k = min(max_links, n)
+    if n == 0 or k <= 0:
+        return [[] for _ in ids], {"mode": "approximate", "nodes": n}
+
+    n_lists = max(1, int(np.sqrt(n)))
+    centroids, assignment = kmeans(matrix, n_lists)
+    n_lists = len(centroids)
+    members = [np.flatnonzero(assignment == c) for c in range(n_lists)]
+    # lists ordered by how close their centroid is to each list's centroid
+    probe_order = np.argsort(pairwise_distances(centroids, centroids, space), axis=1)
+
+    def candidates_for(c: int, nprobe: int) -> np.ndarray:
+        return np.concatenate([members[p] for p in probe_order[c, :nprobe]])
+
+    # -- pick nprobe on a sample against the exact answer --
+    rng = np.random.default_rng(1)
+    sample = np.sort(rng.choice(n, size=min(sample_size, n), replace=False))
+    sample_rows, _ = plan_blocks(n, memory_budget, 1)
+    exact = _links_against(sample, np.arange(n), matrix, ids, k, distance_threshold, space, sample_rows)
+
+    def sample_links(nprobe: int):
+        result = [None] * len(sample)
+        for c in np.unique(assignment[sample]):
+            rows = np.flatnonzero(assignment[sample] == c)
+            candidates = candidates_for(c, nprobe)
+            for r, links in zip(rows, _links_against(sample[rows], candidates, matrix, ids, k, distance_threshold, space, sample_rows)):
+                result[r] = links
+        return result
+
+    nprobe = 1
+    recall = link_recall(sample_links(nprobe), exact)
+    while recall < recall_target and nprobe < n_lists:
+        if cancelled is not None and cancelled():
+            raise LinkComputationCancelled()
+        nprobe = min(nprobe * 2, n_lists)
+        recall = link_recall(sample_links(nprobe), exact)
+
+    # -- full pass, one list at a time --
+    # blocks are sized for the widest candidate set, so any mix of lists in flight fits
+    sizes = np.array([len(m) for m in members])
+    widest = int(max(sizes[probe_order[c, :nprobe]].sum() for c in range(n_lists)))
+    block_rows, workers = plan_blocks(widest, memory_budget, workers)
+    result: List[List[Tuple[str, float]]] = [[] for _ in ids]
+    done = 0
+    lock = threading.Lock()
+
+    def run_list(c: int):
+        nonlocal done
+        if cancelled is not None and cancelled():
+            raise LinkComputationCancelled()
+        rows = members[c]
+        if len(rows) == 0:
+            return
+        candidates = candidates_for(c, nprobe)
+        for i, links in zip(rows, _links_against(rows, candidates, matrix, ids, k, distance_threshold, space, block_rows)):
+            result[i] = links
+        with lock:
+            done += len(rows)
+            if progress is not None:
+                progress(done)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for future in [pool.submit(run_list, c) for c in range(n_lists)]:
+            future.result()
+
+    report = {
+        "mode": "approximate",
+        "nodes": n,
+        "lists": n_lists,
+        "nprobe": nprobe,
+        "recall_target": recall_target,
+        "sample_size": len(sample),
+        "sample_recall": round(recall, 4),
+        "block_rows": block_rows,
+        "workers": workers,
+    }
+    return result, report
@@ -0,0 +1,395 @@
+# -- graph edge store --
+#
+# user_links and s_links used to live as json strings inside chroma metadata,
+# so every list / refactor / update had to json.loads every node and "who links
+# to X" meant scanning the whole collection. edges now live in their own sqlite
+# table, indexed on both endpoints, with the distance between the two nodes
+# stored on each edge.
+#
+# collections are keyed by chroma's collection id, so renames keep their edges.
+# a collection's legacy metadata links are imported the first time it is used.
+#
+# every collection also has a version number, bumped after each change to its
+# nodes or edges, and DOMAINS holds the version of the collection list. they
+# live here so all workers agree on them. each bump also records which nodes
+# were inserted / updated / deleted at that version, so clients can catch up
+# with just the difference (the last change_log_versions versions are kept).
+
+import json
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from graph_links import collection_space, paired_distances
+
+
+USER = "user"
+SEMANTIC = "semantic"
+
+# version key of the collection list itself
+DOMAINS = "*"
+
+# change log ops
+INSERTED = "inserted"
+UPDATED = "updated"
+DELETED = "deleted"
+
+# (target id, distance or None), in link order
+ScoredLinks = List[Tuple[str, Optional[float]]]
+
+
+class GraphStore:
+    def __init__(self, path: str = "graph.db", change_log_versions: int = 1000):
+        self._change_log_versions = change_log_versions
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._lock = threading.RLock()
+        self._migrated = set()
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS edges (
+                collection_id TEXT NOT NULL,
+                src           TEXT NOT NULL,
+                kind          TEXT NOT NULL,
+                dst           TEXT NOT NULL,
+                position      INTEGER NOT NULL,
+                distance      REAL,
+                PRIMARY KEY (collection_id, src, kind, dst)
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS edges_by_dst ON edges (collection_id, dst, kind);
+
+            CREATE TABLE IF NOT EXISTS migrated_collections (
+                collection_id TEXT PRIMARY KEY,
+                migrated_at   REAL NOT NULL
+            );
+
+            CREATE TABLE IF NOT EXISTS versions (
+                collection_id TEXT PRIMARY KEY,
+                version       INTEGER NOT NULL
+            );
+
+            CREATE TABLE IF NOT EXISTS changes (
+                collection_id TEXT NOT NULL,
+                version       INTEGER NOT NULL,
+                node_id       TEXT NOT NULL,
+                op            TEXT NOT NULL,
+                PRIMARY KEY (collection_id, version, node_id)
+            ) WITHOUT ROWID;
+            """
+        )
+
+    # -- migration from chroma metadata --
+
+    def ensure_migrated(self, collection) -> str:
+        """Imports the collection's metadata links once. Returns the collection id used as key."""
+        collection_id = str(collection.id)
+        if collection_id in self._migrated:
+            return collection_id
+        if self._is_migrated(collection_id):
+            self._migrated.add(collection_id)
+            return collection_id
+
+        # the chroma read and the distances happen without the lock, so version
+        # lookups and other collections' writes don't wait on a big import
+        rows = self._metadata_edges(collection, collection_id)
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                done = self._db.execute(
+                    "SELECT 1 FROM migrated_collections WHERE collection_id = ?", (collection_id,)
+                ).fetchone()
+                if done is None:
+                    self._db.executemany(
+                        "INSERT OR REPLACE INTO edges (collection_id, src, kind, dst, position, distance) VALUES (?, ?, ?, ?, ?, ?)",
+                        rows,
+                    )
+                    self._db.execute(
+                        "INSERT INTO migrated_collections (collection_id, migrated_at) VALUES (?, ?)",
+                        (collection_id, time.time()),
+                    )
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+        self._migrated.add(collection_id)
+        return collection_id
+
+    def _is_migrated(self, collection_id: str) -> bool:
+        with self._lock:
+            return self._db.execute(
+                "SELECT 1 FROM migrated_collections WHERE collection_id = ?", (collection_id,)
+            ).fetchone() is not None
+
+    def _metadata_edges(self, collection, collection_id: str) -> list:
+        """Edge rows for the links stored in the collection's metadata (legacy format)."""
+        nodes = collection.get(include=["metadatas", "embeddings"])
+        ids = nodes.get("ids") or []
+        metadatas = nodes.get("metadatas") or []
+        embeddings = nodes.get("embeddings")
+        if not ids:
+            return []
+        row_of = {node_id: i for i, node_id in enumerate(ids)}
+        matrix = np.asarray(embeddings, dtype=np.float32) if embeddings is not None else None
+        space = collection_space(collection)
+
+        edges = []
+        for node_id, meta in zip(ids, metadatas):
+            for kind, key in ((USER, "user_links"), (SEMANTIC, "s_links")):
+                try:
+                    targets = json.loads((meta or {}).get(key, "[]"))
+                except Exception:
+                    targets = []
+                for position, dst in enumerate(dict.fromkeys(targets)):
+                    edges.append((node_id, kind, dst, position))
+
+        # distances for the imported edges, computed once here
+        distances = [None] * len(edges)
+        if matrix is not None and len(matrix):
+            known = [i for i, (src, _, dst, _) in enumerate(edges) if dst in row_of]
+            for start in range(0, len(known), 4096):
+                chunk = known[start : start + 4096]
+                src_rows = matrix[[row_of[edges[i][0]] for i in chunk]]
+                dst_rows = matrix[[row_of[edges[i][2]] for i in chunk]]
+                pair = paired_distances(src_rows, dst_rows, space)
+                for i, d in zip(chunk, pair):
+                    distances[i] = float(d)
+
+        return [(collection_id, src, kind, dst, position, d) for (src, kind, dst, position), d in zip(edges, distances)]
+
+    # -- writes --
+
+    def set_links(self, collection_id: str, kind: str, links: Dict[str, ScoredLinks]):
+        """Replaces the outgoing edges of the given kind for every src in links."""
+        if not links:
+            return
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                self._db.executemany(
+                    "DELETE FROM edges WHERE collection_id = ? AND src = ? AND kind = ?",
+                    [(collection_id, src, kind) for src in links],
+                )
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO edges (collection_id, src, kind, dst, position, distance) VALUES (?, ?, ?, ?, ?, ?)",
+                    [
+                        (collection_id, src, kind, dst, position, distance)
+                        for src, scored in links.items()
+                        for position, (dst, distance) in enumerate(scored)
+                    ],
+                )
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+
+    def delete_node(self, collection_id: str, node_id: str) -> Dict[str, List[str]]:
+        """Removes every edge from or to node_id. Returns {kind: [srcs that linked to it]}."""
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                linkers = self._reverse(collection_id, node_id)
+                self._db.execute(
+                    "DELETE FROM edges WHERE collection_id = ? AND (src = ? OR dst = ?)",
+                    (collection_id, node_id, node_id),
+                )
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+        return linkers
+
+    def drop_collection(self, collection_id: str):
+        with self._lock:
+            self._db.execute("DELETE FROM edges WHERE collection_id = ?", (collection_id,))
+            self._db.execute("DELETE FROM migrated_collections WHERE collection_id = ?", (collection_id,))
+            self._db.execute("DELETE FROM versions WHERE collection_id = ?", (collection_id,))
+            self._db.execute("DELETE FROM changes WHERE collection_id = ?", (collection_id,))
+        self._migrated.discard(collection_id)
+
+    # -- versions --
+
+    def bump(
+        self,
+        collection_id: str,
+        inserted: Iterable[str] = (),
+        updated: Iterable[str] = (),
+        deleted: Iterable[str] = (),
+    ) -> int:
+        """Marks the collection (or DOMAINS) as changed and logs the touched nodes. Returns the new version."""
+        ops = {}
+        for op, node_ids in ((UPDATED, updated), (INSERTED, inserted), (DELETED, deleted)):
+            ops.update((node_id, op) for node_id in node_ids)
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                version = self._db.execute(
+                    "INSERT INTO versions (collection_id, version) VALUES (?, 1) "
+                    "ON CONFLICT (collection_id) DO UPDATE SET version = version + 1 RETURNING version",
+                    (collection_id,),
+                ).fetchone()[0]
+                self._db.executemany(
+                    "INSERT INTO changes (collection_id, version, node_id, op) VALUES (?, ?, ?, ?)",
+                    [(collection_id, version, node_id, op) for node_id, op in ops.items()],
+                )
+                self._db.execute(
+                    "DELETE FROM changes WHERE collection_id = ? AND version <= ?",
+                    (collection_id, version - self._change_log_versions),
+                )
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+        return version
+
+    def version(self, collection_id: str) -> int:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT version FROM versions WHERE collection_id = ?", (collection_id,)
+            ).fetchone()
+        return row[0] if row else 0
+
+    def changes_since(self, collection_id: str, since: int) -> Tuple[int, Optional[Dict[str, str]]]:
+        """
+        (current version, {node_id: op}) with one net op per node changed after since.
+        The ops are None when since is too old for the log (or from the future).
+        """
+        with self._lock:
+            row = self._db.execute(
+                "SELECT version FROM versions WHERE collection_id = ?", (collection_id,)
+            ).fetchone()
+            version = row[0] if row else 0
+            if since > version or since < version - self._change_log_versions:
+                return version, None
+            rows = self._db.execute(
+                "SELECT node_id, op FROM changes WHERE collection_id = ? AND version > ? AND version <= ? "
+                "ORDER BY version",
+                (collection_id, since, version),
+            ).fetchall()
+
+        ops: Dict[str, str] = {}
+        for node_id, op in rows:
+            before = ops.get(node_id)
+            if before == INSERTED and op == DELETED:
+                del ops[node_id]  # came and went
+            elif before == INSERTED and op == UPDATED:
+                pass  # still new to the client
+            elif before == DELETED and op == INSERTED:
+                ops[node_id] = UPDATED
+            else:
+                ops[node_id] = op
+        return version, ops
+
+    # -- reads --
+
+    def links_of(self, collection_id: str, node_ids: Iterable[str]) -> Dict[str, Dict[str, ScoredLinks]]:
+        """{src: {kind: [(dst, distance)]}} for the given nodes, each an index range scan."""
+        result = {node_id: {USER: [], SEMANTIC: []} for node_id in node_ids}
+        if not result:
+            return result
+        with self._lock:
+            for src in result:
+                for kind, dst, distance in self._db.execute(
+                    "SELECT kind, dst, distance FROM edges WHERE collection_id = ? AND src = ? ORDER BY kind, position",
+                    (collection_id, src),
+                ):
+                    result[src][kind].append((dst, distance))
+        return result
+
+    def all_links(self, collection_id: str) -> Dict[str, Dict[str, ScoredLinks]]:
+        result: Dict[str, Dict[str, ScoredLinks]] = {}
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT src, kind, dst, distance FROM edges WHERE collection_id = ? ORDER BY src, kind, position",
+                (collection_id,),
+            ).fetchall()
+        for src, kind, dst, distance in rows:
+            result.setdefault(src, {USER: [], SEMANTIC: []})[kind].append((dst, distance))
+        return result
+
+    def neighborhood(
+        self,
+        collection_id: str,
+        seeds: Sequence[str],
+        depth: int,
+        max_nodes: int,
+        max_edges: int,
+    ) -> Tuple[Dict[str, int], List[Tuple[str, str, str, Optional[float]]], bool]:
+        """
+        Breadth-first over edges in both directions from the seeds, up to depth hops.
+        Returns ({node_id: hops}, [(src, kind, dst, distance)] between those nodes, truncated).
+        """
+        hops: Dict[str, int] = {}
+        for seed in seeds:
+            if len(hops) < max_nodes:
+                hops.setdefault(seed, 0)
+        truncated = len(hops) < len(set(seeds))
+        frontier = list(hops)
+        with self._lock:
+            for hop in range(1, depth + 1):
+                next_frontier = []
+                for rows in self._edges_touching(collection_id, frontier):
+                    for src, _, dst, _ in rows:
+                        for node_id in (src, dst):
+                            if node_id in hops:
+                                continue
+                            if len(hops) >= max_nodes:
+                                truncated = True
+                                continue
+                            hops[node_id] = hop
+                            next_frontier.append(node_id)
+                frontier = next_frontier
+                if not frontier:
+                    break
+
+            # every edge between the nodes found, including the outer ring's
+            edges = []
+            for rows in self._edges_from(collection_id, list(hops)):
+                for edge in rows:
+                    if edge[2] not in hops:
+                        continue
+                    if len(edges) >= max_edges:
+                        truncated = True
+                        break
+                    edges.append(edge)
+        return hops, edges, truncated
+
+    def _edges_from(self, collection_id: str, node_ids: List[str], chunk_size: int = 500):
+        for start in range(0, len(node_ids), chunk_size):
+            chunk = node_ids[start : start + chunk_size]
+            marks = ",".join("?" * len(chunk))
+            yield self._db.execute(
+                f"SELECT src, kind, dst, distance FROM edges WHERE collection_id = ? AND src IN ({marks}) "
+                "ORDER BY src, kind, position",
+                (collection_id, *chunk),
+            ).fetchall()
+
+    def _edges_touching(self, collection_id: str, node_ids: List[str], chunk_size: int = 500):
+        yield from self._edges_from(collection_id, node_ids, chunk_size)
+        for start in range(0, len(node_ids), chunk_size):
+            chunk = node_ids[start : start + chunk_size]
+            marks = ",".join("?" * len(chunk))
+            yield self._db.execute(
+                f"SELECT src, kind, dst, distance FROM edges WHERE collection_id = ? AND dst IN ({marks})",
+                (collection_id, *chunk),
+            ).fetchall()
+
+    def reverse(self, collection_id: str, node_id: str) -> Dict[str, List[str]]:
+        """{kind: [srcs linking to node_id]} from the dst index."""
+        with self._lock:
+            return self._reverse(collection_id, node_id)
+
+    def _reverse(self, collection_id: str, node_id: str) -> Dict[str, List[str]]:
+        linkers = {USER: [], SEMANTIC: []}
+        for src, kind in self._db.execute(
+            "SELECT src, kind FROM edges WHERE collection_id = ? AND dst = ?", (collection_id, node_id)
+        ):
+            linkers[kind].append(src)
+        return linkers
+
+
+def link_ids(scored: Sequence[Tuple[str, Optional[float]]]) -> List[str]:
+    return [dst for dst, _ in scored]
@@ -0,0 +1,203 @@
+# -- lexical (BM25) node index --
+#
+# vector search alone misses exact terms: formula names, acronyms, people. node
+# names and contents are also kept in a sqlite FTS5 index, ranked with BM25
+# (a name hit counts more than a content hit), and written next to every
+# chroma insert / update / delete. a collection that existed before the index
+# is filled from chroma the first time it is used.
+#
+# reciprocal_rank_fusion merges the lexical and the vector ranking, so a small
+# max_results still gets the hits that only one of them finds. the index needs
+# no embedding, so it also answers while the model is loading.
+
+import re
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+# (node_id, name, content)
+Document = Tuple[str, str, str]
+
+# name hits weigh more than content hits
+NAME_WEIGHT = 2.0
+CONTENT_WEIGHT = 1.0
+
+# question words and glue that match nearly every node
+STOPWORDS = frozenset(
+    """
+    a an and are as at be by can do does for from has have how i in is it its me my of on or so
+    that the their there this to was were what when where which who why will with you your
+    """.split()
+)
+
+
+def query_terms(text: str, max_terms: int = 32) -> List[str]:
+    """The words of a query worth matching, lowercased, in order, without repeats."""
+    words = re.findall(r"\w+", text.lower())
+    terms = [w for w in dict.fromkeys(words) if w not in STOPWORDS]
+    return terms[:max_terms]
+
+
+def reciprocal_rank_fusion(rankings: Iterable[Sequence[str]], k: int = 60, limit: Optional[int] = None) -> List[str]:
+    """Ids ordered by sum(1 / (k + rank)) over the rankings they appear in (rank starts at 1)."""
+    scores: Dict[str, float] = {}
+    for ranking in rankings:
+        for rank, node_id in enumerate(ranking, start=1):
+            scores[node_id] = scores.get(node_id, 0.0) + 1.0 / (k + rank)
+    fused = sorted(scores, key=lambda node_id: -scores[node_id])
+    return fused[:limit] if limit is not None else fused
+
+
+class LexicalIndex:
+    def __init__(self, path: str = "lexical.db"):
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._lock = threading.RLock()
+        self._indexed = set()
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS docs (
+                doc_id        INTEGER PRIMARY KEY,
+                collection_id TEXT NOT NULL,
+                node_id       TEXT NOT NULL,
+                UNIQUE (collection_id, node_id)
+            );
+
+            -- rowid = docs.doc_id
+            CREATE VIRTUAL TABLE IF NOT EXISTS docs_fts USING fts5(
+                name, content, tokenize = 'unicode61 remove_diacritics 2'
+            );
+
+            CREATE TABLE IF NOT EXISTS indexed_collections (
+                collection_id TEXT PRIMARY KEY,
+                indexed_at    REAL NOT NULL
+            );
+            """
+        )
+
+    # -- backfill --
+
+    def ensure_indexed(self, collection, collection_id: str):
+        """Indexes the collection's existing nodes once."""
+        if collection_id in self._indexed:
+            return
+        with self._lock:
+            done = self._db.execute(
+                "SELECT 1 FROM indexed_collections WHERE collection_id = ?", (collection_id,)
+            ).fetchone()
+        if done is None:
+            # read from chroma without the lock, searches and writes go on meanwhile
+            nodes = collection.get(include=["documents", "metadatas"])
+            ids = nodes.get("ids") or []
+            documents = nodes.get("documents") or [""] * len(ids)
+            metadatas = nodes.get("metadatas") or [None] * len(ids)
+            with self._lock:
+                self._db.execute("BEGIN IMMEDIATE")
+                try:
+                    done = self._db.execute(
+                        "SELECT 1 FROM indexed_collections WHERE collection_id = ?", (collection_id,)
+                    ).fetchone()
+                    if done is None:
+                        self._upsert(
+                            collection_id,
+                            [(node_id, (meta or {}).get("name", ""), doc) for node_id, doc, meta in zip(ids, documents, metadatas)],
+                        )
+                        self._db.execute(
+                            "INSERT INTO indexed_collections (collection_id, indexed_at) VALUES (?, ?)",
+                            (collection_id, time.time()),
+                        )
+                    self._db.execute("COMMIT")
+                except Exception:
+                    self._db.execute("ROLLBACK")
+                    raise
+        self._indexed.add(collection_id)
+
+    # -- writes --
+
+    def upsert(self, collection_id: str, documents: Sequence[Document]):
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                self._upsert(collection_id, documents)
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+
+    def delete(self, collection_id: str, node_ids: Iterable[str]):
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                for node_id in node_ids:
+                    row = self._db.execute(
+                        "DELETE FROM docs WHERE collection_id = ? AND node_id = ? RETURNING doc_id",
+                        (collection_id, node_id),
+                    ).fetchone()
+                    if row is not None:
+                        self._db.execute("DELETE FROM docs_fts WHERE rowid = ?", row)
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+
+    def drop_collection(self, collection_id: str):
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                self._db.execute(
+                    "DELETE FROM docs_fts WHERE rowid IN (SELECT doc_id FROM docs WHERE collection_id = ?)",
+                    (collection_id,),
+                )
+                self._db.execute("DELETE FROM docs WHERE collection_id = ?", (collection_id,))
+                self._db.execute("DELETE FROM indexed_collections WHERE collection_id = ?", (collection_id,))
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+        self._indexed.discard(collection_id)
+
+    # -- search --
+
+    def search(self, collection_id: str, text: str, limit: int) -> List[Tuple[str, float]]:
+        """(node_id, bm25 score) best first; higher is better. Any query term may match."""
+        terms = query_terms(text)
+        if not terms or limit < 1:
+            return []
+        match = " OR ".join('"' + term.replace('"', '""') + '"' for term in terms)
+        with self._lock:
+            rows = self._db.execute(
+                """
+                SELECT docs.node_id, bm25(docs_fts, ?, ?) AS score
+                FROM docs_fts JOIN docs ON docs.doc_id = docs_fts.rowid
+                WHERE docs_fts MATCH ? AND docs.collection_id = ?
+                ORDER BY score
+                LIMIT ?
+                """,
+                (NAME_WEIGHT, CONTENT_WEIGHT, match, collection_id, limit),
+            ).fetchall()
+        # sqlite's bm25 is negative, lower is better
+        return [(node_id, -score) for node_id, score in rows]
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    # -- internals --
+
+    def _upsert(self, collection_id: str, documents: Sequence[Document]):
+        for node_id, name, content in documents:
+            row = self._db.execute(
+                "SELECT doc_id FROM docs WHERE collection_id = ? AND node_id = ?", (collection_id, node_id)
+            ).fetchone()
+            if row is None:
+                doc_id = self._db.execute(
+                    "INSERT INTO docs (collection_id, node_id) VALUES (?, ?)", (collection_id, node_id)
+                ).lastrowid
+            else:
+                doc_id = row[0]
+                self._db.execute("DELETE FROM docs_fts WHERE rowid = ?", (doc_id,))
+            self._db.execute(
+                "INSERT INTO docs_fts (rowid, name, content) VALUES (?, ?, ?)", (doc_id, name or "", content or "")
+            )
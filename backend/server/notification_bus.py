@@ -0,0 +1,118 @@
+# -- cross-worker notification bus --
+#
+# `clients` is per process, so with several uvicorn workers a change made by
+# one worker only reached the browsers connected to that worker. every
+# notification is now also appended to a small sqlite table that all workers
+# on the host share; each worker polls it and hands the other workers'
+# messages to its own sockets. nothing but a file is needed.
+#
+# polling is cheap: PRAGMA data_version only changes when another connection
+# committed, so an idle bus costs one pragma per poll interval.
+
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Awaitable, Callable, List, Optional, Tuple
+
+
+class NotificationBus:
+    def __init__(self, path: str = "events.db", poll_interval_ms: float = 100.0, retention_seconds: float = 60.0):
+        self.origin = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self.poll_interval = max(0.01, poll_interval_ms / 1000)
+        self.retention_seconds = retention_seconds
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._lock = threading.Lock()
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS events (
+                id         INTEGER PRIMARY KEY AUTOINCREMENT,
+                created_at REAL NOT NULL,
+                origin     TEXT NOT NULL,
+                payload    TEXT NOT NULL
+            );
+            """
+        )
+        self._worker: Optional[asyncio.Task] = None
+        self._last_id = 0
+        self._last_prune = 0.0
+
+        # -- stats --
+        self._published = 0
+        self._received = 0
+
+    # -- lifecycle --
+
+    def start(self, deliver: Callable[[str], Awaitable[None]]):
+        """Starts polling; deliver(payload) gets every message published by the other workers."""
+        if self._worker is None or self._worker.done():
+            # only what is published from now on
+            self._last_id = self._db.execute("SELECT COALESCE(MAX(id), 0) FROM events").fetchone()[0]
+            self._worker = asyncio.create_task(self._run(deliver))
+
+    async def stop(self):
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+
+    # -- public api --
+
+    async def publish(self, payload: str):
+        await asyncio.to_thread(self._insert, payload)
+        self._published += 1
+
+    def stats(self) -> dict:
+        return {
+            "origin": self.origin,
+            "published": self._published,
+            "received": self._received,
+            "last_id": self._last_id,
+            "poll_interval_ms": round(self.poll_interval * 1000, 1),
+        }
+
+    # -- internals --
+
+    def _insert(self, payload: str):
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO events (created_at, origin, payload) VALUES (?, ?, ?)",
+                (now, self.origin, payload),
+            )
+            if now - self._last_prune > self.retention_seconds:
+                self._last_prune = now
+                self._db.execute("DELETE FROM events WHERE created_at < ?", (now - self.retention_seconds,))
+
+    def _poll(self, data_version: Optional[int]) -> Tuple[int, List[str]]:
+        with self._lock:
+            current = self._db.execute("PRAGMA data_version").fetchone()[0]
+            if current == data_version:
+                return current, []
+            rows = self._db.execute(
+                "SELECT id, origin, payload FROM events WHERE id > ? ORDER BY id", (self._last_id,)
+            ).fetchall()
+        if rows:
+            self._last_id = rows[-1][0]
+        return current, [payload for _, origin, payload in rows if origin != self.origin]
+
+    async def _run(self, deliver: Callable[[str], Awaitable[None]]):
+        data_version = None
+        while True:
+            try:
+                data_version, payloads = await asyncio.to_thread(self._poll, data_version)
+                for payload in payloads:
+                    self._received += 1
+                    await deliver(payload)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Notification bus poll failed: {e}")
+            await asyncio.sleep(self.poll_interval)
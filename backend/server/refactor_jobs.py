@@ -0,0 +1,137 @@
+# -- refactor jobs --
+#
+# /nodes/refactor used to hold the http request open for the whole recompute.
+# now it submits a job and returns right away. job state lives in sqlite so any
+# uvicorn worker can report progress or cancel it, and so only one refactor
+# per collection runs at a time across all workers.
+
+import json
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Optional, Tuple
+
+
+# a running job whose worker stopped heart-beating for this long is considered dead
+stale_after_seconds = 60
+
+
+class RefactorJobStore:
+    def __init__(self, path: str = "jobs.db"):
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._db.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS refactor_jobs (
+                job_id           TEXT PRIMARY KEY,
+                collection       TEXT NOT NULL,
+                params           TEXT NOT NULL,
+                status           TEXT NOT NULL,
+                processed        INTEGER NOT NULL DEFAULT 0,
+                total            INTEGER NOT NULL DEFAULT 0,
+                changed          INTEGER,
+                report           TEXT,
+                error            TEXT,
+                cancel_requested INTEGER NOT NULL DEFAULT 0,
+                started_at       REAL NOT NULL,
+                updated_at       REAL NOT NULL,
+                finished_at      REAL
+            );
+            CREATE UNIQUE INDEX IF NOT EXISTS refactor_jobs_one_running
+                ON refactor_jobs (collection) WHERE status = 'running';
+            """
+        )
+        # jobs.db files created before the report column existed
+        columns = {row[1] for row in self._db.execute("PRAGMA table_info(refactor_jobs)")}
+        if "report" not in columns:
+            self._db.execute("ALTER TABLE refactor_jobs ADD COLUMN report TEXT")
+
+    def claim(self, collection: str, params: dict) -> Tuple[dict, bool]:
+        """Starts a job for the collection, or returns the one already running (joined=True)."""
+        now = time.time()
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                self._db.execute(
+                    "UPDATE refactor_jobs SET status = 'failed', error = 'worker stopped responding', finished_at = ? "
+                    "WHERE collection = ? AND status = 'running' AND updated_at < ?",
+                    (now, collection, now - stale_after_seconds),
+                )
+                row = self._db.execute(
+                    "SELECT * FROM refactor_jobs WHERE collection = ? AND status = 'running'",
+                    (collection,),
+                ).fetchone()
+                if row is not None:
+                    self._db.execute("COMMIT")
+                    return self._to_dict(row), True
+
+                job_id = str(uuid.uuid4())
+                self._db.execute(
+                    "INSERT INTO refactor_jobs (job_id, collection, params, status, started_at, updated_at) "
+                    "VALUES (?, ?, ?, 'running', ?, ?)",
+                    (job_id, collection, json.dumps(params), now, now),
+                )
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+        return self.get(job_id), False
+
+    def get(self, job_id: str) -> Optional[dict]:
+        with self._lock:
+            row = self._db.execute("SELECT * FROM refactor_jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return self._to_dict(row) if row is not None else None
+
+    def heartbeat(self, job_id: str, processed: int, total: int) -> bool:
+        """Saves progress and returns whether a cancel was requested."""
+        with self._lock:
+            self._db.execute(
+                "UPDATE refactor_jobs SET processed = ?, total = ?, updated_at = ? WHERE job_id = ?",
+                (processed, total, time.time(), job_id),
+            )
+            row = self._db.execute(
+                "SELECT cancel_requested FROM refactor_jobs WHERE job_id = ?", (job_id,)
+            ).fetchone()
+        return bool(row and row[0])
+
+    def request_cancel(self, job_id: str) -> Optional[dict]:
+        with self._lock:
+            self._db.execute(
+                "UPDATE refactor_jobs SET cancel_requested = 1 WHERE job_id = ? AND status = 'running'",
+                (job_id,),
+            )
+        return self.get(job_id)
+
+    def finish(
+        self,
+        job_id: str,
+        status: str,
+        changed: Optional[int] = None,
+        report: Optional[dict] = None,
+        error: Optional[str] = None,
+    ):
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "UPDATE refactor_jobs SET status = ?, changed = ?, report = ?, error = ?, updated_at = ?, finished_at = ? "
+                "WHERE job_id = ?",
+                (status, changed, json.dumps(report) if report is not None else None, error, now, now, job_id),
+            )
+
+    @staticmethod
+    def _to_dict(row: sqlite3.Row) -> dict:
+        job = dict(row)
+        job["params"] = json.loads(job["params"])
+        job["report"] = json.loads(job["report"]) if job.get("report") else None
+        job["cancel_requested"] = bool(job["cancel_requested"])
+
+        # eta from the rate so far
+        eta = None
+        if job["status"] == "running" and job["processed"] and job["total"]:
+            elapsed = job["updated_at"] - job["started_at"]
+            eta = round(elapsed / job["processed"] * (job["total"] - job["processed"]), 1)
+        job["eta_seconds"] = eta
+        return job
@@ -0,0 +1,203 @@
+# -- rolling-summary chat memory --
+#
+# SQLChatMessageHistory hands the whole conversation to the prompt on every
+# turn, so long sessions got slower with each message until they no longer fit
+# in num_ctx. RollingSummaryHistory still stores every message the same way
+# (the /history endpoints keep reading all of them), but the prompt only gets
+# a running summary of the older turns plus the last keep_turns turns
+# verbatim, trimmed to a token budget.
+#
+# after each answer, the turns that left the verbatim window are folded into
+# the summary in the background; the summary and the id of the last message it
+# covers are kept in conversation_summaries, next to message_store in
+# chat_memory.db. until an update lands, the uncovered turns are sent verbatim
+# (at most twice the window), so nothing is lost while the llm is busy.
+
+import asyncio
+import time
+from typing import Awaitable, Callable, Dict, List, Optional, Sequence, Tuple
+
+from langchain_community.chat_message_histories import SQLChatMessageHistory
+from langchain_core.messages import BaseMessage, SystemMessage
+from sqlalchemy import select, text
+
+
+class SummaryStore:
+    """Per-session rolling summaries in the chat memory database."""
+
+    def __init__(self, engine):
+        self._engine = engine
+        self._ready = False
+
+    async def get(self, session_id: str) -> Tuple[str, int]:
+        """(summary, id of the last message it covers); ("", 0) for a new session."""
+        await self._create_table()
+        async with self._engine.connect() as conn:
+            row = (
+                await conn.execute(
+                    text("SELECT summary, covered_id FROM conversation_summaries WHERE session_id = :session_id"),
+                    {"session_id": session_id},
+                )
+            ).first()
+        return (row[0], row[1]) if row else ("", 0)
+
+    async def put(self, session_id: str, summary: str, covered_id: int):
+        await self._create_table()
+        async with self._engine.begin() as conn:
+            await conn.execute(
+                text(
+                    "INSERT INTO conversation_summaries (session_id, summary, covered_id, updated_at)"
+                    " VALUES (:session_id, :summary, :covered_id, :updated_at)"
+                    " ON CONFLICT (session_id) DO UPDATE SET"
+                    " summary = excluded.summary, covered_id = excluded.covered_id, updated_at = excluded.updated_at"
+                ),
+                {"session_id": session_id, "summary": summary, "covered_id": covered_id, "updated_at": time.time()},
+            )
+
+    async def clear(self, session_id: str):
+        await self._create_table()
+        async with self._engine.begin() as conn:
+            await conn.execute(
+                text("DELETE FROM conversation_summaries WHERE session_id = :session_id"), {"session_id": session_id}
+            )
+
+    async def _create_table(self):
+        if self._ready:
+            return
+        async with self._engine.begin() as conn:
+            await conn.execute(
+                text(
+                    """
+                    CREATE TABLE IF NOT EXISTS conversation_summaries (
+                        session_id TEXT PRIMARY KEY,
+                        summary    TEXT NOT NULL,
+                        covered_id INTEGER NOT NULL,
+                        updated_at REAL NOT NULL
+                    )
+                    """
+                )
+            )
+        self._ready = True
+
+
+class SummaryUpdater:
+    """
+    Folds the turns that left a session's verbatim window into its summary, one
+    update per session at a time. summarize(summary, new_lines) returns the new
+    summary.
+    """
+
+    def __init__(self, store: SummaryStore, summarize: Callable[[str, str], Awaitable[str]]):
+        self.store = store
+        self.summarize = summarize
+        self._running: Dict[str, asyncio.Task] = {}
+        self._again = set()  # sessions that got more messages during their update
+
+        # -- stats --
+        self._updates = 0
+        self._failures = 0
+        self._folded = 0
+        self._update_sum = 0.0
+
+    def schedule(self, history: "RollingSummaryHistory"):
+        session_id = history.session_id
+        if session_id in self._running:
+            self._again.add(session_id)
+            return
+        task = asyncio.create_task(self._run(history))
+        self._running[session_id] = task
+        task.add_done_callback(lambda _: self._running.pop(session_id, None))
+
+    async def stop(self):
+        for task in list(self._running.values()):
+            task.cancel()
+        await asyncio.gather(*self._running.values(), return_exceptions=True)
+
+    def stats(self) -> dict:
+        updates = self._updates or 1
+        return {
+            "running": len(self._running),
+            "updates": self._updates,
+            "failures": self._failures,
+            "messages_folded": self._folded,
+            "mean_update_ms": round(self._update_sum / updates * 1000, 1),
+        }
+
+    async def _run(self, history: "RollingSummaryHistory"):
+        while True:
+            self._again.discard(history.session_id)
+            try:
+                await self._update(history)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self._failures += 1
+                print(f"Warning: summary update for {history.session_id} failed: {e}")
+                return
+            if history.session_id not in self._again:
+                return
+
+    async def _update(self, history: "RollingSummaryHistory"):
+        summary, covered_id = await self.store.get(history.session_id)
+        rows = await history.rows_after(covered_id)
+        old = rows[: -history.keep_messages] if history.keep_messages else rows
+        if not old:
+            return
+        started = time.perf_counter()
+        new_lines = "\n".join(f"{message.type.capitalize()}: {message.content}" for _, message in old)
+        summary = await self.summarize(summary, new_lines)
+        await self.store.put(history.session_id, summary, old[-1][0])
+        self._updates += 1
+        self._folded += len(old)
+        self._update_sum += time.perf_counter() - started
+
+
+class RollingSummaryHistory(SQLChatMessageHistory):
+    def __init__(
+        self,
+        session_id: str,
+        connection,
+        updater: SummaryUpdater,
+        keep_turns: int = 4,
+        token_budget: Optional[int] = None,
+        count_tokens: Optional[Callable[[str], int]] = None,
+    ):
+        super().__init__(session_id=session_id, connection=connection)
+        self.updater = updater
+        self.keep_messages = max(0, keep_turns) * 2  # a turn is a question and its answer
+        self.token_budget = token_budget
+        self.count_tokens = count_tokens
+
+    async def rows_after(self, covered_id: int) -> List[Tuple[int, BaseMessage]]:
+        """(id, message) of the session's messages after covered_id, oldest first."""
+        await self._acreate_table_if_not_exists()
+        model = self.sql_model_class
+        async with self._make_async_session() as session:
+            result = await session.execute(
+                select(model)
+                .where(getattr(model, self.session_id_field_name) == self.session_id, model.id > covered_id)
+                .order_by(model.id.asc())
+            )
+            return [(record.id, self.converter.from_sql_model(record)) for record in result.scalars()]
+
+    async def aget_messages(self) -> List[BaseMessage]:
+        """The summary (as a system message) and the recent turns, within the token budget."""
+        summary, covered_id = await self.updater.store.get(self.session_id)
+        recent = [message for _, message in await self.rows_after(covered_id)]
+        recent = recent[-2 * self.keep_messages :] if self.keep_messages else []
+        head = [SystemMessage(content=f"Summary of the earlier conversation: {summary}")] if summary else []
+        if self.token_budget and self.count_tokens:
+            used = sum(self.count_tokens(str(message.content)) for message in head + recent)
+            # oldest turns go first, whole, and the last exchange always stays
+            while len(recent) > 2 and used > self.token_budget:
+                used -= sum(self.count_tokens(str(message.content)) for message in recent[:2])
+                del recent[:2]
+        return head + recent
+
+    async def aadd_messages(self, messages: Sequence[BaseMessage]) -> None:
+        await super().aadd_messages(messages)
+        self.updater.schedule(self)
+
+    async def aclear(self) -> None:
+        await super().aclear()
+        await self.updater.store.clear(self.session_id)
@@ -0,0 +1,40 @@
+# -- response serialization --
+#
+# big responses (node lists, change sets) are built as plain dicts straight
+# from chroma results and encoded here in one call: orjson by default, or
+# MessagePack for clients that send Accept: application/msgpack. no pydantic
+# object per node and no stdlib json on the hot path.
+
+from typing import Optional
+
+import orjson
+import ormsgpack
+from fastapi import Request
+from fastapi.responses import Response
+
+
+JSON = "application/json"
+MSGPACK = "application/msgpack"
+
+
+def media_type_for(request: Optional[Request]) -> str:
+    """MSGPACK when the client asks for it, JSON otherwise."""
+    if request is not None:
+        accept = request.headers.get("accept", "")
+        if MSGPACK in accept or "application/x-msgpack" in accept:
+            return MSGPACK
+    return JSON
+
+
+def dumps(content, media_type: str = JSON) -> bytes:
+    if media_type == MSGPACK:
+        return ormsgpack.packb(content, option=ormsgpack.OPT_SERIALIZE_NUMPY)
+    return orjson.dumps(content, option=orjson.OPT_SERIALIZE_NUMPY)
+
+
+def respond(request: Optional[Request], content, status_code: int = 200, headers: Optional[dict] = None) -> Response:
+    """Encodes content in the format the client accepts."""
+    media_type = media_type_for(request)
+    headers = dict(headers or {})
+    headers["Vary"] = "Accept"
+    return Response(content=dumps(content, media_type), status_code=status_code, media_type=media_type, headers=headers)
@@ -12,16 +12,45 @@ from fastapi import (
     WebSocketDisconnect,
     BackgroundTasks,
 )
-from fastapi.responses import JSONResponse, StreamingResponse
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 import json
 import pprint
 import chromadb
-from sentence_transformers import SentenceTransformer
 import uuid
-from typing import List, Optional
+from typing import Callable, Dict, List, Optional
 import asyncio
+from embedding_batcher import EmbeddingBatcher
+from embedding_cache import EmbeddingCache
+from embedding_backends import backend_model_id, load_backend
+from embedding_sidecar import SidecarClient
+from graph_links import (
+    LinkComputationCancelled,
+    approx_knn_links,
+    batch_links,
+    collection_space,
+    knn_links,
+    paired_distances,
+    pick_links,
+)
+from refactor_jobs import RefactorJobStore
+from graph_store import DELETED, DOMAINS, INSERTED, SEMANTIC, UPDATED, USER, GraphStore, link_ids
+from snapshots import SnapshotCache, VersionedCache
+from serialization import dumps, media_type_for, respond
+from graph_layout import compute_layout
+from graph_clusters import cluster_graph, default_cluster_count
+from notification_bus import NotificationBus
+from broadcaster import Broadcaster
+from coalescer import NotificationCoalescer
+from chroma_repo import ChromaRepository
+from lexical_index import LexicalIndex, reciprocal_rank_fusion
+from context_builder import TokenCounter, build_context
+from rolling_memory import RollingSummaryHistory, SummaryStore, SummaryUpdater
+import threading
+import base64
+import bisect
+import re
 
 
 # -- sentence - transformers  model
@@ -49,10 +78,83 @@ except Exception as e:
 llm_model = "deepseek-r1:7b"
 # llm_model="llama3.1:8b"
 
+# retrieved documents are packed into this many prompt tokens, counted with
+# the llm's tokenizer (huggingface id or tokenizer.json, see context_builder.py;
+# empty = always estimate)
+context_token_budget = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1536"))
+context_tokenizer = os.getenv("CONTEXT_TOKENIZER", "deepseek-ai/DeepSeek-R1-Distill-Qwen-7B")
+
+# chat memory: "summary" = running summary + the last MEMORY_KEEP_TURNS turns in
+# at most MEMORY_TOKEN_BUDGET tokens (see rolling_memory.py), "full" = every message
+memory_mode = os.getenv("MEMORY_MODE", "summary")
+memory_keep_turns = int(os.getenv("MEMORY_KEEP_TURNS", "4"))
+memory_token_budget = int(os.getenv("MEMORY_TOKEN_BUDGET", "1024"))
+
 # some important global parameters
 model = None
 model_ready = asyncio.Event()
 
+# embedding micro-batching (see embedding_batcher.py)
+embed_max_batch_size = int(os.getenv("EMBED_MAX_BATCH_SIZE", "32"))
+embed_max_wait_ms = float(os.getenv("EMBED_MAX_WAIT_MS", "5"))
+
+# embedding backend: "torch" (sentence-transformers) or "onnx" (see embedding_backends.py)
+embed_backend = os.getenv("EMBED_BACKEND", "torch")
+embed_quantized = os.getenv("EMBED_QUANTIZED", "0") == "1"
+embed_threads = int(os.getenv("EMBED_THREADS", "0"))
+
+# shared embedding process for multi-worker runs, e.g. /tmp/wevn-embed.sock (see embedding_sidecar.py)
+embed_sidecar = os.getenv("EMBED_SIDECAR")
+# seconds a worker keeps retrying a sidecar that is not up yet before the request fails;
+# after that, requests fail right away (lexical fallback) and one connect is tried
+# per EMBED_SIDECAR_COOLDOWN seconds until it is back
+embed_sidecar_timeout = float(os.getenv("EMBED_SIDECAR_TIMEOUT", "30"))
+embed_sidecar_cooldown = float(os.getenv("EMBED_SIDECAR_COOLDOWN", "10"))
+
+# threads for the all-pairs semantic link refactor (0 = one per core)
+refactor_workers = int(os.getenv("REFACTOR_WORKERS", "0"))
+# memory the refactor's distance blocks may use at once; fewer threads run when it is tight
+refactor_memory_mb = int(os.getenv("REFACTOR_MEMORY_MB", "1024"))
+# "auto" refactor mode switches to the approximate kNN graph above this many nodes
+refactor_approx_above = int(os.getenv("REFACTOR_APPROX_ABOVE", "50000"))
+refactor_recall_target = float(os.getenv("REFACTOR_RECALL_TARGET", "0.95"))
+
+# first query width around a written node, in multiples of max_links; widened
+# until it reaches past distance_threshold (see _neighborhoods)
+link_fanout = int(os.getenv("LINK_FANOUT", "4"))
+
+# embedding cache (see embedding_cache.py)
+embed_cache_path = os.getenv("EMBED_CACHE_PATH", "embedding_cache.db")
+embed_cache_memory_items = int(os.getenv("EMBED_CACHE_MEMORY_ITEMS", "10000"))
+
+# "node" ws messages carry the change itself when it touches at most this many nodes
+ws_inline_changes = int(os.getenv("WS_INLINE_CHANGES", "50"))
+
+# ws notifications are shared between the uvicorn workers through this file (see notification_bus.py)
+events_db_path = os.getenv("EVENTS_DB_PATH", "events.db")
+notify_poll_ms = float(os.getenv("NOTIFY_POLL_MS", "100"))
+
+# per-socket send queue length and send timeout (see broadcaster.py)
+ws_queue_size = int(os.getenv("WS_QUEUE_SIZE", "64"))
+ws_send_timeout = float(os.getenv("WS_SEND_TIMEOUT", "5"))
+
+# "node" / "domain" events within this window are merged into one message,
+# sent at most NOTIFY_MAX_DELAY_MS after the first (see coalescer.py; 0 = off)
+notify_window_ms = float(os.getenv("NOTIFY_WINDOW_MS", "250"))
+notify_max_delay_ms = float(os.getenv("NOTIFY_MAX_DELAY_MS", "1000"))
+
+# every chroma call runs on this many threads, at most CHROMA_MAX_PENDING handed over at once (see chroma_repo.py)
+chroma_workers = int(os.getenv("CHROMA_WORKERS", "8"))
+chroma_max_pending = int(os.getenv("CHROMA_MAX_PENDING", "64"))
+# per-collection lock files that serialize writes across uvicorn workers (empty = this process only)
+write_lock_dir = os.getenv("WRITE_LOCK_DIR", "write_locks")
+
+# /query/stream retrieval: "semantic" (vectors), "lexical" (BM25, see lexical_index.py)
+# or "hybrid" (both, fused by reciprocal rank with constant RRF_K)
+retrieval_modes = ("semantic", "lexical", "hybrid")
+retrieval_mode = os.getenv("RETRIEVAL_MODE", "hybrid")
+rrf_k = int(os.getenv("RRF_K", "60"))
+
 llm = None
 llm_ready = asyncio.Event()
 summary_llm_ready = asyncio.Event()
@@ -69,6 +171,52 @@ async_engine = create_async_engine("sqlite+aiosqlite:///chat_memory.db", echo=Fa
 chain_with_memory = None
 
 
+# -- rolling conversation summary --
+rolling_summary_prompt = PromptTemplate(
+    template="""
+    Progressively summarize a conversation between a user and WevN Assistant.
+    Fold the new lines into the current summary and return only the new summary,
+    at most 200 words. Keep names, numbers, decisions and open questions.
+
+    Current summary:
+    {summary}
+
+    New lines:
+    {new_lines}
+
+    New summary:
+    """,
+    input_variables=["summary", "new_lines"],
+)
+
+
+async def summarize_turns(summary: str, new_lines: str) -> str:
+    await llm_ready.wait()
+    result = await (rolling_summary_prompt | llm).ainvoke(
+        {"summary": summary or "(empty)", "new_lines": new_lines}
+    )
+    # reasoning models put their thinking in front of the answer
+    return re.sub(r"<think>.*?</think>", "", result.content, flags=re.S).strip()
+
+
+summary_store = SummaryStore(async_engine)
+memory_updater = SummaryUpdater(summary_store, summarize_turns)
+
+
+def chat_history(session_id: str):
+    """The message history the chain reads and writes for one conversation."""
+    if memory_mode == "summary":
+        return RollingSummaryHistory(
+            session_id=session_id,
+            connection=async_engine,
+            updater=memory_updater,
+            keep_turns=memory_keep_turns,
+            token_budget=memory_token_budget,
+            count_tokens=token_counter.count,
+        )
+    return SQLChatMessageHistory(session_id=session_id, connection=async_engine)
+
+
 
 
 
@@ -122,23 +270,17 @@ async def lifespan(app: FastAPI):
 
     async def load_model():
         global model
+        if embed_sidecar:
+            # the sidecar owns the model, this worker only talks to it
+            print(f"Using embedding sidecar at {embed_sidecar}")
+            model_ready.set()
+            return
         if model is None:
-            local_path = "../__models__/embedding-model/models--sentence-transformers--all-mpnet-base-v2/snapshots/e8c3b32edf5434bc2275fc9bab85f82640a19130"
-            if os.path.exists(local_path):
-                print("✅ Loading model from local cache...")
-                model = await asyncio.to_thread(lambda: SentenceTransformer(local_path))
-                print("Model loaded!")
-                model_ready.set()
-            else:
-                print("🌐 Downloading model from Hugging Face...")
-                model = await asyncio.to_thread(
-                    lambda: SentenceTransformer(
-                        "all-mpnet-base-v2",
-                        cache_folder="../__models__/embedding-model",
-                    )
-                )
-                print("Model loaded!")
-                model_ready.set()
+            model = await asyncio.to_thread(
+                lambda: load_backend(embed_backend, quantized=embed_quantized, threads=embed_threads)
+            )
+            print(f"Model loaded! ({model.model_id}, dim={model.dim})")
+            model_ready.set()
 
     async def load_llm_and_parser():
         global llm, llm_error, prompt, raw_chain, chain_with_memory
@@ -206,11 +348,8 @@ async def lifespan(app: FastAPI):
                 core_chain = prompt | llm
                 chain_with_memory = RunnableWithMessageHistory(
                     core_chain,
-                    # This lambda function creates an ASYNC history object on the fly for each session
-                    lambda session_id: SQLChatMessageHistory(
-                        session_id=session_id,
-                        connection=async_engine,
-                    ),
+                    # creates an ASYNC history object on the fly for each session (MEMORY_MODE)
+                    chat_history,
                     input_messages_key="question",
                     history_messages_key="conversation",
                 )
@@ -228,17 +367,30 @@ async def lifespan(app: FastAPI):
                 llm_error = e
                 print("llm error : ", e)
 
+    async def load_tokenizer():
+        if await asyncio.to_thread(token_counter.load, context_tokenizer):
+            print(f"Context tokenizer loaded ({token_counter.name})")
+
     asyncio.create_task(load_model())
     asyncio.create_task(load_llm_and_parser())
+    asyncio.create_task(load_tokenizer())
+    notification_bus.start(deliver_to_clients)
 
     yield  # ⚠️ THIS is required! App runs after this
 
     print("Server shutting down")
+    await memory_updater.stop()
+    await coalescer.flush()
+    await notification_bus.stop()
+    await embedder.stop()
+    embedding_cache.close()
+    chroma.shutdown()
+    lexical.close()
     
 
 
-# -- websocket  clients
-clients = []
+# -- websocket  clients (each with its own send queue, see broadcaster.py)
+clients = Broadcaster(queue_size=ws_queue_size, send_timeout=ws_send_timeout)
 
 
 # --- FastAPI app ---
@@ -250,7 +402,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
-    expose_headers=["X-Retrieved-Ids"],
+    expose_headers=["X-Retrieved-Ids", "X-Retrieval-Mode", "X-Context-Tokens", "ETag"],
 )
 
 API_KEY = "mysecretkey"
@@ -289,26 +441,93 @@ async def get_history_by_session_id(session_id: str,db_engine) -> List[BaseMessa
     return messages
 
 # -- permenent ws connection --
+# clients may send {"action": "subscribe" | "unsubscribe", "collections": [...]}
+# to only get the events of those collections ("domain" events always come
+# through); a client that never subscribes gets everything. each action is
+# answered with {"type": "subscribed", "collections": [...]}, or with
+# {"type": "error", "detail": ...} when collections is not a list of names.
 @app.websocket("/ws")
 async def websocket_endpoint(ws: WebSocket, token: str = Query(...)):
     if not validate_token(token):
         await ws.close(code=1008)  # Policy violation
         return
     await ws.accept()
-    clients.append(ws)
+    clients.register(ws)
     # await load_model()
     try:
         while True:
-            await ws.receive_text()  # keep connection alive
+            text = await ws.receive_text()  # keep connection alive
+            _handle_ws_action(ws, text)
     except WebSocketDisconnect:
-        clients.remove(ws)
+        pass
+    finally:
+        await clients.unregister(ws)
+
+
+def _handle_ws_action(ws: WebSocket, text: str):
+    try:
+        request = json.loads(text)
+    except ValueError:
+        return  # plain keep-alive text
+    if not isinstance(request, dict) or request.get("action") not in ("subscribe", "unsubscribe"):
+        return
+    collections = request.get("collections")
+    if collections is None and request.get("collection") is not None:
+        collections = [request["collection"]]
+    if collections is not None and (
+        not isinstance(collections, list) or not all(isinstance(c, str) for c in collections)
+    ):
+        clients.send(ws, json.dumps({"type": "error", "detail": "collections must be a list of collection names"}))
+        return
+    if request["action"] == "subscribe":
+        topics = clients.subscribe(ws, collections or [])
+    else:
+        topics = clients.unsubscribe(ws, collections)
+    clients.send(ws, json.dumps({"type": "subscribed", "collections": topics}))
 
 
 # -- notification sender
-async def notify_clients(change_type):
-    message = json.dumps({"type": change_type})
-    for ws in clients:
-        await ws.send_text(message)
+# this worker's sockets get the message right away, the other workers' through the bus
+notification_bus = NotificationBus(events_db_path, poll_interval_ms=notify_poll_ms)
+coalescer = NotificationCoalescer(notify_window_ms, notify_max_delay_ms)
+
+
+def _coalesce_key(message: dict):
+    """Messages that only describe the latest state of something may replace an unsent older one."""
+    change_type = message.get("type")
+    if change_type in ("node", "bulk-insert"):
+        # a skipped "node" shows up as since > the client's version, see /nodes/changes
+        return (change_type, message.get("collection"))
+    if change_type == "domain":
+        return (change_type,)
+    if change_type == "refactor":
+        return (change_type, (message.get("job") or {}).get("job_id"))
+    return None
+
+
+def _topic(message: dict):
+    """The collection a message is about, None for messages every client needs."""
+    if message.get("type") == "refactor":
+        return (message.get("job") or {}).get("collection")
+    return message.get("collection")
+
+
+async def deliver_to_clients(message: str):
+    try:
+        parsed = json.loads(message)
+        key, topic = _coalesce_key(parsed), _topic(parsed)
+    except Exception:
+        key, topic = None, None
+    clients.broadcast(message, key, topic)
+
+
+async def notify_clients(change_type, **fields):
+    message = json.dumps({"type": change_type, **fields})
+    await deliver_to_clients(message)
+    try:
+        await notification_bus.publish(message)
+    except Exception as e:
+        print(f"Warning: could not publish {change_type} notification to other workers: {e}")
 
 
 # -- Pydantic Models -- this is the structure for each http request start with a Model suffix for each class
@@ -336,6 +555,27 @@ class CollectionNameModel(BaseModel):
     name: str
 
 
+# for listing nodes: without limit / cursor the whole collection comes back as
+# a plain list; fields picks which NodeOut fields to return (node_id always);
+# layout = 2 or 3 adds precomputed "position" coordinates to every node
+class NodeListModel(BaseModel):
+    name: str
+    limit: Optional[int] = None
+    cursor: Optional[str] = None
+    fields: Optional[List[str]] = None
+    layout: Optional[int] = None
+
+
+# for the neighborhood of a few nodes (e.g. the X-Retrieved-Ids of a query)
+class EgoModel(BaseModel):
+    collection: str
+    node_ids: List[str]
+    depth: int = 1
+    max_nodes: int = 200
+    max_edges: int = 2000
+    fields: Optional[List[str]] = None
+
+
 # for renaming a collection
 class CollectionRenameModel(BaseModel):
     d_old: str
@@ -357,6 +597,9 @@ class NodeSemanticRefactorModel(BaseModel):
     collection: str
     distance_threshold: float
     max_links: int
+    # "exact", "approximate" or "auto" (approximate for very large collections)
+    mode: Optional[str] = "auto"
+    recall_target: Optional[float] = None
 
 
 class NodeUpdateModel(BaseModel):
@@ -369,9 +612,19 @@ class NodeUpdateModel(BaseModel):
     max_links: int
 
 
+# one line of a /nodes/bulk-insert NDJSON body
+class BulkNodeModel(BaseModel):
+    name: str
+    content: str
+    user_links: list[str] = []
+
+
 class NodeDeleteModel(BaseModel):
     collection: str
     node_id: str
+    # when given, nodes that linked to the deleted one get a replacement neighbor
+    max_links: Optional[int] = None
+    distance_threshold: Optional[float] = None
 
 
 class QueryModel(BaseModel):
@@ -380,6 +633,7 @@ class QueryModel(BaseModel):
     conversation_id: str
     max_results: Optional[int] = 10
     distance_threshold: Optional[float] = 1.4
+    retrieval_mode: Optional[str] = None  # semantic / lexical / hybrid, RETRIEVAL_MODE when left out
 
 
 class ClearHistoryModel(BaseModel):
@@ -416,15 +670,126 @@ class SummaryReturnModel(BaseModel):
 
 # -- ChromaDB client --
 client = chromadb.PersistentClient(path="db")
+# async handlers reach it through the repository, off the event loop
+chroma = ChromaRepository(
+    client, max_workers=chroma_workers, max_pending=chroma_max_pending, lock_dir=write_lock_dir or None
+)
+
+# -- graph edges (user_links / s_links) live in their own sqlite store, see graph_store.py --
+graph = GraphStore(
+    os.getenv("GRAPH_DB_PATH", "graph.db"),
+    change_log_versions=int(os.getenv("CHANGE_LOG_VERSIONS", "1000")),
+)
+
+# -- BM25 index over node names and contents, kept next to chroma (see lexical_index.py) --
+lexical = LexicalIndex(os.getenv("LEXICAL_DB_PATH", "lexical.db"))
+
+
+def _open_collection(name: str):
+    """Chroma collection plus its graph store key (imports legacy metadata links on first use). Run it with chroma.run."""
+    collection = client.get_collection(name)
+    collection_id = graph.ensure_migrated(collection)
+    lexical.ensure_indexed(collection, collection_id)
+    return collection, collection_id
+
+
+def _open_versioned(name: str):
+    """_open_collection plus the collection's current version, read before a write."""
+    collection, collection_id = _open_collection(name)
+    return collection, collection_id, graph.version(collection_id)
+
+
+# -- list snapshots --
+# /collections/list and the full /nodes/list are served from a snapshot of the
+# current version (see snapshots.py); writers call _changed once they are done
+snapshots = SnapshotCache(int(os.getenv("SNAPSHOT_CACHE_ITEMS", "128")))
+
+
+def _changed(collection_id: str, inserted=(), updated=(), deleted=()) -> int:
+    return graph.bump(collection_id, inserted=inserted, updated=updated, deleted=deleted)
+
+
+def _snapshot_headers(etag: str) -> dict:
+    return {"ETag": etag, "Cache-Control": "no-cache", "Vary": "Accept, Accept-Encoding"}
+
+
+def _not_modified(request: Request, etag: str) -> Optional[Response]:
+    """A 304 when the client's If-None-Match already names etag, else None."""
+    if_none_match = request.headers.get("if-none-match", "")
+    if etag in (tag.strip() for tag in if_none_match.split(",")) or if_none_match.strip() == "*":
+        return Response(status_code=304, headers=_snapshot_headers(etag))
+    return None
+
+
+def _snapshot(request: Request, key, version: int, build: Callable[[], bytes], media_type: str) -> Response:
+    """
+    The snapshot of key at version as a response. The etag follows from key and
+    version, so a 304 is answered before anything is looked up or built.
+    """
+    not_modified = _not_modified(request, snapshots.etag(key, version))
+    if not_modified is not None:
+        return not_modified
+    snapshot = snapshots.get(key, version, build, media_type)
+    headers = _snapshot_headers(snapshot.etag)
+    if "gzip" in request.headers.get("accept-encoding", ""):
+        headers["Content-Encoding"] = "gzip"
+        return Response(content=snapshot.gzipped, media_type=snapshot.media_type, headers=headers)
+    return Response(content=snapshot.body, media_type=snapshot.media_type, headers=headers)
 
 
 # -- Helper Functions --(boring stuff)
 
 
 # -- embedding --
+# concurrent callers are grouped into one batched model.encode() call, either
+# in this worker or in the shared sidecar process
+if embed_sidecar:
+    embedder = SidecarClient(
+        embed_sidecar,
+        expected_model_id=backend_model_id(embed_backend, embed_quantized),
+        connect_timeout=embed_sidecar_timeout,
+        cooldown=embed_sidecar_cooldown,
+    )
+else:
+    embedder = EmbeddingBatcher(
+        lambda texts: model.encode(texts),
+        max_batch_size=embed_max_batch_size,
+        max_wait_ms=embed_max_wait_ms,
+    )
+
+
+# prompt token counting, heuristic until the tokenizer is loaded
+token_counter = TokenCounter()
+
+
+# repeated texts (unchanged node edits, popular questions) skip the model entirely
+embedding_cache = EmbeddingCache(
+    backend_model_id(embed_backend, embed_quantized),
+    path=embed_cache_path,
+    max_memory_items=embed_cache_memory_items,
+)
+
+
 async def model_embedding(text: str) -> list[float]:
+    cached = await asyncio.to_thread(embedding_cache.get, text)
+    if cached is not None:
+        return cached
     await model_ready.wait()
-    return await asyncio.to_thread(lambda: model.encode(text))
+    embedding = await embedder.embed(text)
+    await asyncio.to_thread(embedding_cache.put, text, embedding)
+    return embedding
+
+
+async def model_embedding_many(texts: List[str]) -> list:
+    embeddings = await asyncio.to_thread(lambda: [embedding_cache.get(text) for text in texts])
+    missing = [i for i, e in enumerate(embeddings) if e is None]
+    if missing:
+        await model_ready.wait()
+        computed = await embedder.embed_many([texts[i] for i in missing])
+        for i, embedding in zip(missing, computed):
+            embeddings[i] = embedding
+        await asyncio.to_thread(lambda: [embedding_cache.put(texts[i], embeddings[i]) for i in missing])
+    return embeddings
 
 
 # -- fastapi endpoints --
@@ -438,13 +803,58 @@ def health():
     return StatusModel(status="ok")
 
 
+# -- websocket stats (queue depths, drops, cross-worker bus) --
+@app.get("/stats/ws", dependencies=[Depends(verify_api_key)])
+def ws_stats():
+    return JSONResponse(
+        content={
+            "coalescer": coalescer.stats(),
+            "broadcaster": clients.stats(),
+            "bus": notification_bus.stats(),
+        }
+    )
+
+
+# -- chroma pool stats (queue depth, wait and run times) --
+@app.get("/stats/chroma", dependencies=[Depends(verify_api_key)])
+def chroma_stats():
+    return JSONResponse(content=chroma.stats())
+
+
+# -- rolling summary memory stats --
+@app.get("/stats/memory", dependencies=[Depends(verify_api_key)])
+def memory_stats():
+    return JSONResponse(content={"mode": memory_mode, "summaries": memory_updater.stats()})
+
+
+# -- embedding stats (scheduler batch sizes / queue wait, cache hits) --
+@app.get("/stats/embedding", dependencies=[Depends(verify_api_key)])
+async def embedding_stats():
+    content = {
+        "scheduler": embedder.stats(),
+        "cache": await asyncio.to_thread(embedding_cache.stats),
+    }
+    if embed_sidecar:
+        try:
+            content["sidecar"] = await embedder.sidecar_stats()
+        except Exception as e:
+            content["sidecar"] = {"error": str(e)}
+    return JSONResponse(content=content)
+
+
 # -- list all collections --
 @app.get("/collections/list", dependencies=[Depends(verify_api_key)])
-def list_collection():
+async def list_collection(request: Request):
     try:
-        collections = client.list_collections()
-        return JSONResponse(
-            content=[{"name": str(c.name), "id": str(c.id)} for c in collections]
+        media_type = media_type_for(request)
+        return await chroma.run(
+            lambda: _snapshot(
+                request,
+                ("collections", media_type),
+                graph.version(DOMAINS),
+                lambda: dumps([{"name": str(c.name), "id": str(c.id)} for c in client.list_collections()], media_type),
+                media_type,
+            )
         )
 
     except Exception as e:
@@ -454,78 +864,546 @@ def list_collection():
 
 
 # -- list all nodes for a given collection --
-@app.post("/nodes/list", dependencies=[Depends(verify_api_key)])
-def list_nodes(payload: CollectionNameModel):
+# nodes come back ordered by node_id. with a limit the response is a page,
+# {"nodes": [...], "next_cursor": ...}, and the opaque cursor is passed back to
+# get the next one. leaving out "content" never reads the documents.
+node_fields = list(NodeOut.model_fields)
+
+
+# the sorted ids pages are cut from, built once per collection version
+node_orders = VersionedCache(int(os.getenv("NODE_ORDER_CACHE_ITEMS", "16")))
+
+
+def _sorted_ids(collection, collection_id: str) -> List[str]:
+    return node_orders.get(
+        collection_id, graph.version(collection_id), lambda _: sorted(collection.get(include=[])["ids"])
+    )
+
+
+def _encode_cursor(after: str) -> str:
+    return base64.urlsafe_b64encode(json.dumps({"after": after}).encode()).decode()
+
+
+def _decode_cursor(cursor: str) -> str:
     try:
-        collection = client.get_collection(payload.name)
-        nodes = collection.get(include=["documents", "metadatas"])
-        documents = nodes.get("documents") or []
-        ids = nodes.get("ids") or []
-        metadatas = nodes.get("metadatas") or []
-        result = []
-        for node_id, doc, meta in zip(ids, documents, metadatas):
-            try:
-                user_links = json.loads(meta.get("user_links", "[]"))
-                s_links = json.loads(meta.get("s_links", "[]"))
-            except Exception:
-                user_links = []
-                s_links = []
-            result.append(
-                NodeOut(
-                    node_id=node_id,
-                    name=meta.get("name", ""),
-                    content=doc,
-                    user_links=user_links,
-                    s_links=s_links,
-                )
-            )
-        return result
+        return json.loads(base64.urlsafe_b64decode(cursor.encode()))["after"]
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def _node_rows(collection, collection_id: str, fields: List[str], page_ids: Optional[List[str]] = None) -> list:
+    """Nodes as plain dicts with only the requested fields, ordered by node_id."""
+    include = []
+    if "content" in fields:
+        include.append("documents")
+    if "name" in fields:
+        include.append("metadatas")
+    if page_ids is None:
+        nodes = collection.get(include=include)
+    elif page_ids:
+        nodes = collection.get(ids=page_ids, include=include)
+    else:
+        return []
+
+    ids = nodes.get("ids") or []
+    documents = nodes.get("documents") or [None] * len(ids)
+    metadatas = nodes.get("metadatas") or [None] * len(ids)
+    rows = sorted(zip(ids, documents, metadatas), key=lambda row: row[0])
+
+    links = {}
+    if "user_links" in fields or "s_links" in fields:
+        links = graph.all_links(collection_id) if page_ids is None else graph.links_of(collection_id, ids)
+    no_links = {USER: [], SEMANTIC: []}
+
+    result = []
+    for node_id, doc, meta in rows:
+        node = {"node_id": node_id}
+        if "name" in fields:
+            node["name"] = (meta or {}).get("name", "")
+        if "content" in fields:
+            node["content"] = doc
+        if "user_links" in fields:
+            node["user_links"] = link_ids(links.get(node_id, no_links)[USER])
+        if "s_links" in fields:
+            node["s_links"] = link_ids(links.get(node_id, no_links)[SEMANTIC])
+        result.append(node)
+    return result
+
+
+# -- graph layout --
+# node positions computed from the link graph once per collection version (see
+# graph_layout.py); after small edits only the touched nodes move
+layouts = VersionedCache(int(os.getenv("LAYOUT_CACHE_ITEMS", "32")))
+
+
+def _layout(collection, collection_id: str, dim: int) -> dict:
+    version = graph.version(collection_id)
+
+    def build(previous):
+        ids = collection.get(include=[])["ids"]
+        edges = [
+            (src, dst)
+            for src, kinds in graph.all_links(collection_id).items()
+            for scored in kinds.values()
+            for dst, _ in scored
+        ]
+        positions, changed = None, None
+        if previous is not None:
+            _, ops = graph.changes_since(collection_id, previous[0])
+            if ops is not None:
+                positions, changed = previous[1]["positions"], list(ops)
+        positions, mode = compute_layout(ids, edges, dim, previous=positions, changed=changed)
+        return {"version": version, "dim": dim, "mode": mode, "positions": positions}
+
+    return layouts.get((collection_id, dim), version, build)
+
+
+def _with_positions(rows: list, layout: Optional[dict]) -> list:
+    if layout is not None:
+        positions = layout["positions"]
+        for node in rows:
+            node["position"] = positions.get(node["node_id"])
+    return rows
+
+
+@app.get("/graph/layout", dependencies=[Depends(verify_api_key)])
+async def graph_layout(request: Request, collection: str = Query(...), dim: int = Query(2, ge=2, le=3)):
+    try:
+        target, collection_id = await chroma.run(_open_collection, collection)
+        layout = await chroma.run(_layout, target, collection_id, dim)
+        return respond(request, {"collection": collection, **layout})
     except Exception as e:
-        raise HTTPException(status_code=400, detail=f"Failed to list nodes: {str(e)}")
+        raise HTTPException(status_code=400, detail=f"Failed to compute layout: {str(e)}")
 
 
-@app.post("/nodes/refactor", dependencies=[Depends(verify_api_key)])
-def refactor_nodes(
-    payload: NodeSemanticRefactorModel, background_tasks: BackgroundTasks
-):
+# -- ego network --
+# the nodes within depth hops of the given ones over user_links and s_links
+# (both directions), walked in the edge store. chroma is only asked for the
+# fields requested, so without "content" no document is read.
+ego_default_fields = ["node_id", "name", "content"]
+
+
+def _ego(payload: EgoModel, fields: List[str]) -> dict:
+    collection, collection_id = _open_collection(payload.collection)
+    version = graph.version(collection_id)
+    hops, edges, truncated = graph.neighborhood(
+        collection_id,
+        list(dict.fromkeys(payload.node_ids)),
+        min(payload.depth, 6),
+        min(payload.max_nodes, 5000),
+        min(payload.max_edges, 50000),
+    )
+    nodes = _node_rows(collection, collection_id, fields, list(hops))
+    for node in nodes:
+        node["depth"] = hops[node["node_id"]]
+    return {
+        "collection": payload.collection,
+        "version": version,
+        "nodes": nodes,
+        "edges": [
+            {"source": src, "target": dst, "kind": kind, "distance": distance}
+            for src, kind, dst, distance in edges
+        ],
+        "truncated": truncated,
+    }
+
+
+@app.post("/graph/ego", dependencies=[Depends(verify_api_key)])
+async def graph_ego(payload: EgoModel, request: Request):
+    fields = payload.fields or ego_default_fields
+    unknown = set(fields) - set(node_fields)
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {sorted(unknown)}")
+    if not payload.node_ids:
+        raise HTTPException(status_code=400, detail="node_ids must not be empty")
+    if payload.depth < 0 or payload.max_nodes < 1 or payload.max_edges < 0:
+        raise HTTPException(status_code=400, detail="depth and max_edges must be non-negative, max_nodes at least 1")
     try:
-        collection = client.get_collection(payload.collection)
-        nodes = collection.get(include=["metadatas", "embeddings"])
+        return respond(request, await chroma.run(_ego, payload, fields))
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Failed to read neighborhood: {str(e)}")
+
+
+# -- cluster view --
+# k-means over the stored embeddings for a zoomed-out view of big collections
+# (see graph_clusters.py), cached per version and warm-started from the
+# previous version's centroids so cluster numbers don't jump around
+clusterings = VersionedCache(int(os.getenv("CLUSTER_CACHE_ITEMS", "16")))
+
+
+def _clusters(collection, collection_id: str, k: Optional[int]) -> dict:
+    version = graph.version(collection_id)
+
+    def build(previous):
+        nodes = collection.get(include=["embeddings", "metadatas"])
         ids = nodes.get("ids") or []
-        metadatas = nodes.get("metadatas") or []
         embeddings = nodes.get("embeddings")
-        if embeddings is None:
-            embeddings = []
-        meta_result = []
-        id_result = []
-        for node_id, meta, embedding in zip(ids, metadatas, embeddings):
-            q_result = collection.query(
-                query_embeddings=embedding,
-                n_results=payload.max_links,
-                include=["distances"],
-            )
-            s_links = []
-            for i, id in enumerate(q_result["ids"][0]):
-                if (
-                    id != node_id
-                    and q_result["distances"][0][i] <= payload.distance_threshold
-                ):
-                    s_links.append(id)
-            meta["s_links"] = json.dumps(s_links)
-            meta_result.append(meta)
-            id_result.append(node_id)
-
-        collection.update(ids=id_result, metadatas=meta_result)
-        background_tasks.add_task(notify_clients, "node")
-        return StatusModel(
-            status=f"Refactored semantic links for nodes in {payload.collection} Successfully."
+        names = [(meta or {}).get("name", "") for meta in nodes.get("metadatas") or [None] * len(ids)]
+        edges = [
+            (src, dst)
+            for src, kinds in graph.all_links(collection_id).items()
+            for scored in kinds.values()
+            for dst, _ in scored
+        ]
+        init = previous[1]["centroids"] if previous is not None else None
+        result = cluster_graph(
+            ids,
+            embeddings if embeddings is not None else [],
+            names,
+            edges,
+            k or default_cluster_count(len(ids)),
+            init=init,
+        )
+        return {"version": version, "nodes": len(ids), **result}
+
+    return clusterings.get((collection_id, k), version, build)
+
+
+@app.get("/graph/clusters", dependencies=[Depends(verify_api_key)])
+async def graph_clusters(request: Request, collection: str = Query(...), k: Optional[int] = Query(None, ge=1, le=1024)):
+    try:
+        target, collection_id = await chroma.run(_open_collection, collection)
+        result = await chroma.run(_clusters, target, collection_id, k)
+        return respond(
+            request,
+            {
+                "collection": collection,
+                "version": result["version"],
+                "nodes": result["nodes"],
+                "clusters": result["clusters"],
+                "edges": result["edges"],
+            },
+        )
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Failed to cluster collection: {str(e)}")
+
+
+# drill-down: the member nodes of one cluster, same fields as /nodes/list
+@app.get("/graph/clusters/{cluster}", dependencies=[Depends(verify_api_key)])
+async def graph_cluster_members(
+    request: Request,
+    cluster: int,
+    collection: str = Query(...),
+    k: Optional[int] = Query(None, ge=1, le=1024),
+    fields: Optional[List[str]] = Query(None),
+):
+    fields = fields or node_fields
+    unknown = set(fields) - set(node_fields)
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {sorted(unknown)}")
+    try:
+        target, collection_id = await chroma.run(_open_collection, collection)
+        result = await chroma.run(_clusters, target, collection_id, k)
+        members = sorted(node_id for node_id, c in result["assignment"].items() if c == cluster)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Failed to cluster collection: {str(e)}")
+    if not members:
+        raise HTTPException(status_code=404, detail=f"Cluster {cluster} not found")
+    return respond(
+        request,
+        {
+            "collection": collection,
+            "version": result["version"],
+            "cluster": cluster,
+            "nodes": await chroma.run(_node_rows, target, collection_id, fields, members),
+        },
+    )
+
+
+def _list_nodes(payload: NodeListModel, request: Request, fields: List[str]) -> Response:
+    collection, collection_id = _open_collection(payload.name)
+    if payload.limit is None and payload.cursor is None:
+        # the whole collection: one shared snapshot per version and field set
+        fields = [f for f in node_fields if f in fields]
+        media_type = media_type_for(request)
+        return _snapshot(
+            request,
+            ("nodes", collection_id, tuple(fields), payload.layout, media_type),
+            graph.version(collection_id),
+            lambda: dumps(
+                _with_positions(
+                    _node_rows(collection, collection_id, fields),
+                    _layout(collection, collection_id, payload.layout) if payload.layout else None,
+                ),
+                media_type,
+            ),
+            media_type,
         )
 
+    # keyset pagination over the sorted ids: stable while nodes come and go
+    all_ids = _sorted_ids(collection, collection_id)
+    start = bisect.bisect_right(all_ids, _decode_cursor(payload.cursor)) if payload.cursor else 0
+    page_ids = all_ids[start : start + payload.limit] if payload.limit else all_ids[start:]
+    next_cursor = None
+    if payload.limit and start + payload.limit < len(all_ids):
+        next_cursor = _encode_cursor(page_ids[-1])
+    nodes = _with_positions(
+        _node_rows(collection, collection_id, fields, page_ids),
+        _layout(collection, collection_id, payload.layout) if payload.layout else None,
+    )
+    return respond(request, {"nodes": nodes, "next_cursor": next_cursor})
+
+
+@app.post("/nodes/list", dependencies=[Depends(verify_api_key)])
+async def list_nodes(payload: NodeListModel, request: Request):
+    fields = payload.fields or node_fields
+    unknown = set(fields) - set(node_fields)
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {sorted(unknown)}")
+    if payload.limit is not None and payload.limit < 1:
+        raise HTTPException(status_code=400, detail="limit must be at least 1")
+    if payload.layout not in (None, 2, 3):
+        raise HTTPException(status_code=400, detail="layout must be 2 or 3")
+
+    try:
+        return await chroma.run(_list_nodes, payload, request, fields)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Failed to list nodes: {str(e)}")
+
+
+# -- change feed --
+# every write logs the nodes it touched under the collection's new version, so
+# a client at version N only needs the nodes changed since N instead of the
+# whole list. when the log no longer reaches back to N the answer is
+# {"reset": true} and the client reloads /nodes/list.
+def _changes(collection, collection_id: str, since: int) -> dict:
+    version, ops = graph.changes_since(collection_id, since)
+    if ops is None:
+        return {"version": version, "since": since, "reset": True}
+    current = [node_id for node_id, op in ops.items() if op != DELETED]
+    rows = {node["node_id"]: node for node in _node_rows(collection, collection_id, node_fields, current)}
+    return {
+        "version": version,
+        "since": since,
+        "reset": False,
+        "inserted": [rows[node_id] for node_id, op in ops.items() if op == INSERTED and node_id in rows],
+        "updated": [rows[node_id] for node_id, op in ops.items() if op == UPDATED and node_id in rows],
+        # includes nodes deleted again after the version was read
+        "deleted": [node_id for node_id, op in ops.items() if op == DELETED or node_id not in rows],
+    }
+
+
+@app.get("/nodes/changes", dependencies=[Depends(verify_api_key)])
+async def node_changes(request: Request, collection: str = Query(...), since: int = Query(..., ge=0)):
+    try:
+        target, collection_id = await chroma.run(_open_collection, collection)
+        delta = await chroma.run(_changes, target, collection_id, since)
+        return respond(request, {"collection": collection, **delta})
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Failed to read changes: {str(e)}")
+
+
+async def notify_node_change(collection: str, since: int):
+    """Queues a "node" event; a burst of them for one collection becomes one message."""
+    await coalescer.submit(
+        ("node", collection),
+        since,
+        lambda since, events: _send_node_change(collection, since, events),
+        merge=min,
+    )
+
+
+async def notify_domain_change():
+    async def send(_, events):
+        await notify_clients("domain", version=await asyncio.to_thread(graph.version, DOMAINS), events=events)
+
+    await coalescer.submit(("domain",), None, send)
+
+
+async def _send_node_change(collection: str, since: int, events: int):
+    """Sends "node" with the collection's new version, and the change itself when it is small."""
+    message = {"collection": collection, "events": events}
+    try:
+        target, collection_id = await chroma.run(_open_collection, collection)
+        delta = await chroma.run(_changes, target, collection_id, since)
+        message["version"] = delta["version"]
+        size = 0 if delta["reset"] else len(delta["inserted"]) + len(delta["updated"]) + len(delta["deleted"])
+        if not delta["reset"] and size <= ws_inline_changes:
+            message["changes"] = delta
     except Exception as e:
+        print(f"Warning: could not build change payload for {collection}: {e}")
+    await notify_clients("node", **message)
+
+
+# -- semantic link refactor --
+refactor_jobs = RefactorJobStore(os.getenv("JOBS_DB_PATH", "jobs.db"))
+refactor_tasks = set()  # keeps running job tasks referenced
+
+
+def _refactor_collection(payload: NodeSemanticRefactorModel, progress: dict, cancelled) -> dict:
+    """
+    Recomputes every node's s_links from a snapshot of the collection, without
+    writing them (see _write_refactor). Runs on the chroma pool;
+    progress["processed"/"total"] is updated as blocks finish.
+    """
+    collection, collection_id = _open_collection(payload.collection)
+    # read before the snapshot: whatever changes after it is left to _write_refactor
+    version = graph.version(collection_id)
+    nodes = collection.get(include=["embeddings"])
+    ids = nodes.get("ids") or []
+    embeddings = nodes.get("embeddings")
+    if embeddings is None:
+        embeddings = []
+    progress["total"] = len(ids)
+
+    mode = payload.mode or "auto"
+    if mode == "auto":
+        mode = "approximate" if len(ids) > refactor_approx_above else "exact"
+    options = dict(
+        space=collection_space(collection),
+        workers=refactor_workers or None,
+        memory_budget=refactor_memory_mb * 1024 * 1024,
+        progress=lambda done: progress.__setitem__("processed", done),
+        cancelled=cancelled,
+    )
+    if mode == "approximate":
+        # inverted-list kNN graph, recall checked on a sample (see graph_links.py)
+        new_links, report = approx_knn_links(
+            ids,
+            embeddings,
+            payload.max_links,
+            payload.distance_threshold,
+            recall_target=payload.recall_target or refactor_recall_target,
+            **options,
+        )
+    elif mode == "exact":
+        # all nodes against all nodes in blocked matrix multiplies (see graph_links.py)
+        new_links = knn_links(ids, embeddings, payload.max_links, payload.distance_threshold, **options)
+        report = {"mode": "exact", "nodes": len(ids)}
+    else:
+        raise ValueError(f"Unknown refactor mode: {payload.mode}")
+    return {
+        "collection": collection,
+        "collection_id": collection_id,
+        "version": version,
+        "ids": ids,
+        "links": new_links,
+        "report": report,
+    }
+
+
+def _write_refactor(payload: NodeSemanticRefactorModel, result: dict) -> int:
+    """
+    Writes back the recomputed links that changed (chroma pool, collection
+    write lock held). Nodes written since the snapshot keep the links those
+    writes maintained; nodes whose new links point at a node deleted since then
+    are relinked against the current collection. Returns the changed node count.
+    """
+    collection, collection_id = result["collection"], result["collection_id"]
+    _, ops = graph.changes_since(collection_id, result["version"])
+    if ops is None:
+        raise ValueError("The collection changed too much while the refactor ran, run it again")
+    deleted = {node_id for node_id, op in ops.items() if op == DELETED}
+
+    # only write back the nodes whose links actually changed
+    old_links = graph.all_links(collection_id)
+    changed, stale = {}, []
+    for node_id, s_links in zip(result["ids"], result["links"]):
+        if node_id in ops:
+            continue
+        if deleted.intersection(link_ids(s_links)):
+            stale.append(node_id)
+        elif link_ids(old_links.get(node_id, {}).get(SEMANTIC, [])) != link_ids(s_links):
+            changed[node_id] = s_links
+    graph.set_links(collection_id, SEMANTIC, changed)
+    relinked = _relink(collection, collection_id, stale, payload.max_links, payload.distance_threshold)
+    updated = list(dict.fromkeys([*changed, *relinked]))
+    if updated:
+        _changed(collection_id, updated=updated)
+    return len(updated)
+
+
+async def _refactor(payload: NodeSemanticRefactorModel, progress: dict, cancelled):
+    """Computes without the write lock, writes with it. Returns (changed node count, report)."""
+    result = await chroma.run(_refactor_collection, payload, progress, cancelled)
+    if cancelled():
+        raise LinkComputationCancelled()
+    async with chroma.writing(result["collection_id"]):
+        changed = await chroma.run(_write_refactor, payload, result)
+    return changed, result["report"]
+
+
+async def run_refactor_job(job_id: str, payload: NodeSemanticRefactorModel):
+    """Runs the refactor off the event loop, pushing progress over /ws until it ends."""
+    progress = {"processed": 0, "total": 0}
+    try:
+        since = (await chroma.run(_open_versioned, payload.collection))[2]
+    except Exception as e:
+        # the collection went away after the job was claimed
+        await asyncio.to_thread(refactor_jobs.finish, job_id, "failed", error=str(e))
+        await notify_clients("refactor", job=await asyncio.to_thread(refactor_jobs.get, job_id))
+        return
+    cancel = threading.Event()
+    work = asyncio.create_task(_refactor(payload, progress, cancel.is_set))
+    while not work.done():
+        await asyncio.wait({work}, timeout=0.5)
+        if await asyncio.to_thread(refactor_jobs.heartbeat, job_id, progress["processed"], progress["total"]):
+            cancel.set()
+        if not work.done():
+            await notify_clients("refactor", job=await asyncio.to_thread(refactor_jobs.get, job_id))
+
+    changed = None
+    try:
+        changed, report = work.result()
+        await asyncio.to_thread(refactor_jobs.finish, job_id, "done", changed=changed, report=report)
+    except LinkComputationCancelled:
+        await asyncio.to_thread(refactor_jobs.finish, job_id, "cancelled")
+    except Exception as e:
+        await asyncio.to_thread(refactor_jobs.finish, job_id, "failed", error=str(e))
+    await notify_clients("refactor", job=await asyncio.to_thread(refactor_jobs.get, job_id))
+    if changed:
+        await notify_node_change(payload.collection, since)
+
+
+# submits a refactor job; a second submit for the same collection joins the running one
+@app.post("/nodes/refactor", dependencies=[Depends(verify_api_key)])
+async def refactor_nodes(payload: NodeSemanticRefactorModel):
+    params = {
+        "max_links": payload.max_links,
+        "distance_threshold": payload.distance_threshold,
+        "mode": payload.mode,
+        "recall_target": payload.recall_target,
+    }
+    try:
+        await chroma.get_collection(payload.collection)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Refactor failed with error: {str(e)}")
+    job, joined = await asyncio.to_thread(refactor_jobs.claim, payload.collection, params)
+    if joined and job["params"] != params:
         raise HTTPException(
-            status_code=400,
-            detail=f"Failed to refactored semantic links for nodes in  {payload.collection} - {str(e)}",
+            status_code=409,
+            detail=f"A refactor of {payload.collection} with different parameters is already running (job {job['job_id']}).",
         )
+    if not joined:
+        task = asyncio.create_task(run_refactor_job(job["job_id"], payload))
+        refactor_tasks.add(task)
+        task.add_done_callback(refactor_tasks.discard)
+    return JSONResponse(
+        content={
+            "status": f"Refactor of semantic links for nodes in {payload.collection} {'already running' if joined else 'started'}.",
+            "job_id": job["job_id"],
+            "joined": joined,
+            "job": job,
+        }
+    )
+
+
+@app.get("/jobs/{job_id}", dependencies=[Depends(verify_api_key)])
+def get_job(job_id: str):
+    job = refactor_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+    return JSONResponse(content=job)
+
+
+@app.post("/jobs/{job_id}/cancel", dependencies=[Depends(verify_api_key)])
+def cancel_job(job_id: str):
+    job = refactor_jobs.request_cancel(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+    return JSONResponse(content=job)
 
 
 # -- POST requests --
@@ -537,10 +1415,11 @@ def refactor_nodes(
 
 # -- create  a new collection --
 @app.post("/collections/create", dependencies=[Depends(verify_api_key)])
-def create_collection(payload: CollectionNameModel, background_tasks: BackgroundTasks):
+async def create_collection(payload: CollectionNameModel, background_tasks: BackgroundTasks):
     try:
-        client.create_collection(name=payload.name)
-        background_tasks.add_task(notify_clients, "domain")
+        await chroma.create_collection(payload.name)
+        await chroma.run(_changed, DOMAINS)
+        background_tasks.add_task(notify_domain_change)
         return StatusModel(status=f"Created Domain {payload.name} Successfully.")
     except Exception as e:
         raise HTTPException(
@@ -549,11 +1428,21 @@ def create_collection(payload: CollectionNameModel, background_tasks: Background
 
 
 # -- delete a collection --
+def _drop_collection_state(collection_id: str):
+    """Edges, versions and the lexical index of a deleted collection."""
+    graph.drop_collection(collection_id)
+    lexical.drop_collection(collection_id)
+    _changed(DOMAINS)
+
+
 @app.post("/collections/delete", dependencies=[Depends(verify_api_key)])
-def delete_collection(payload: CollectionNameModel, background_tasks: BackgroundTasks):
+async def delete_collection(payload: CollectionNameModel, background_tasks: BackgroundTasks):
     try:
-        client.delete_collection(payload.name)
-        background_tasks.add_task(notify_clients, "domain")
+        collection_id = str((await chroma.get_collection(payload.name)).id)
+        async with chroma.writing(collection_id):
+            await chroma.delete_collection(payload.name)
+        await chroma.run(_drop_collection_state, collection_id)
+        background_tasks.add_task(notify_domain_change)
         return StatusModel(status=f"Deleted Domain {payload.name} Successfully.")
     except Exception as e:
         raise HTTPException(
@@ -563,13 +1452,13 @@ def delete_collection(payload: CollectionNameModel, background_tasks: Background
 
 # -- rename a collection --
 @app.post("/collections/rename", dependencies=[Depends(verify_api_key)])
-def rename_collection(
+async def rename_collection(
     payload: CollectionRenameModel, background_tasks: BackgroundTasks
 ):
     try:
-        collection = client.get_collection(payload.d_old)
-        collection.modify(name=payload.d_new)
-        background_tasks.add_task(notify_clients, "domain")
+        await chroma.rename_collection(payload.d_old, payload.d_new)
+        await chroma.run(_changed, DOMAINS)
+        background_tasks.add_task(notify_domain_change)
         return StatusModel(
             status=f"Renamed  Domain {payload.d_old} to {payload.d_new} Successfully."
         )
@@ -580,35 +1469,151 @@ def rename_collection(
 
 
 
+# -- incremental semantic link maintenance --
+# every write keeps the links of its neighborhood current, using the same rule
+# as the refactor (a node's max_links nearest, itself included then dropped,
+# under the threshold), so a full refactor is only needed after the
+# max_links / distance_threshold parameters change.
+
+
+def _own_links(node_id: str, ids, distances, max_links: int, distance_threshold: float) -> List[str]:
+    """Refactor rule for a node whose own id may not be in the query result yet."""
+    return pick_links(
+        [node_id] + list(ids), [0.0] + list(distances), max_links, distance_threshold, exclude=node_id
+    )
+
+
+def _neighborhoods(collection, embeddings, max_links: int, distance_threshold: float):
+    """
+    Per embedding, (ids, distances) of every node within distance_threshold,
+    nearest first, and at least the max_links nearest. kNN isn't symmetric, so
+    a node far down a new node's list may still want it as a link: the query
+    is widened until its farthest hit is over the threshold or the collection
+    runs out.
+    """
+    total = collection.count()
+    if total == 0 or len(embeddings) == 0:
+        return [([], []) for _ in embeddings]
+    n = min(max(max_links * link_fanout, max_links, 1), total)
+    while True:
+        q_result = collection.query(query_embeddings=list(embeddings), n_results=n, include=["distances"])
+        rows = list(zip(q_result["ids"], q_result["distances"]))
+        if n >= total or all(len(ids) < n or distances[-1] > distance_threshold for ids, distances in rows):
+            return rows
+        n = min(n * 2, total)
+
+
+def _neighborhood(collection, embedding, max_links: int, distance_threshold: float):
+    """_neighborhoods for one embedding."""
+    return _neighborhoods(collection, [embedding], max_links, distance_threshold)[0]
+
+
+def _back_link_candidates(collection_id: str, distances: Dict[str, float], max_links: int) -> List[str]:
+    """
+    The nodes (id -> distance to a written node) that may now take it among their
+    links: those with room left, or whose farthest stored link is no closer.
+    """
+    if max_links <= 1:
+        return []  # the node itself takes the only slot
+    current = graph.links_of(collection_id, list(distances))
+    candidates = []
+    for node_id, distance in distances.items():
+        links = current[node_id][SEMANTIC]
+        if (
+            len(links) < max_links - 1
+            or any(d is None for _, d in links)
+            or distance <= max(d for _, d in links)
+        ):
+            candidates.append(node_id)
+    return candidates
+
+
+def _user_links(collection, embedding, user_links: List[str]):
+    """User links as (id, distance) edges; distance is None when the target is unknown."""
+    user_links = list(dict.fromkeys(user_links))
+    if not user_links:
+        return []
+    targets = collection.get(ids=user_links, include=["embeddings"])
+    embeddings = targets.get("embeddings")
+    by_id = dict(zip(targets.get("ids") or [], embeddings if embeddings is not None else []))
+    known = [id for id in user_links if id in by_id]
+    distances = {}
+    if known:
+        pair = paired_distances([embedding] * len(known), [by_id[id] for id in known], collection_space(collection))
+        distances = dict(zip(known, (float(d) for d in pair)))
+    return [(id, distances.get(id)) for id in user_links]
+
+
+def _relink(collection, collection_id: str, node_ids, max_links: int, distance_threshold: float) -> List[str]:
+    """Recomputes s_links for a handful of existing nodes with one batched query. Returns the ones that changed."""
+    node_ids = list(dict.fromkeys(node_ids))
+    if not node_ids:
+        return []
+    nodes = collection.get(ids=node_ids, include=["embeddings"])
+    ids = nodes.get("ids") or []
+    if not ids:
+        return []
+    q_result = collection.query(
+        query_embeddings=nodes["embeddings"],
+        n_results=max_links,
+        include=["distances"],
+    )
+    old_links = graph.links_of(collection_id, ids)
+    changed = {}
+    for row, node_id in enumerate(ids):
+        s_links = pick_links(
+            q_result["ids"][row], q_result["distances"][row], max_links, distance_threshold, exclude=node_id
+        )
+        if link_ids(old_links[node_id][SEMANTIC]) != link_ids(s_links):
+            changed[node_id] = s_links
+    graph.set_links(collection_id, SEMANTIC, changed)
+    return list(changed)
+
+
 async def _create_node_logic(payload: NodeInputModel):
     """
     Core logic for creating a node in ChromaDB.
     This function can be called from anywhere.
     """
-    collection = client.get_collection(payload.collection)
+    collection, collection_id = await chroma.run(_open_collection, payload.collection)
     embedding = await model_embedding(f"Name: {payload.name}. {payload.content}")
+    async with chroma.writing(collection_id):
+        return await chroma.run(_insert_node, collection, collection_id, payload, embedding)
+
+
+def _insert_node(collection, collection_id: str, payload: NodeInputModel, embedding) -> str:
+    """The chroma / graph side of an insert (chroma pool, collection write lock held)."""
     node_id = str(uuid.uuid1())
-    q_result = collection.query(
-        query_embeddings=embedding,
-        n_results=payload.max_links,
-        include=["distances"],
+    around_ids, around_distances = _neighborhood(
+        collection, embedding, payload.max_links, payload.distance_threshold
     )
 
-    s_links = []
-    for i, id in enumerate(q_result["ids"][0]):
-        if q_result["distances"][0][i] <= payload.distance_threshold:
-            s_links.append(id)
-    metadata = {
-        "name": payload.name,
-        "user_links": json.dumps(payload.user_links),
-        "s_links": json.dumps(s_links),
-    }
+    s_links = _own_links(
+        node_id, around_ids, around_distances, payload.max_links, payload.distance_threshold
+    )
     collection.add(
         documents=[payload.content],
         ids=[node_id],
         embeddings=[embedding],
-        metadatas=[metadata],
+        metadatas=[{"name": payload.name}],
+    )
+    lexical.upsert(collection_id, [(node_id, payload.name, payload.content)])
+    graph.set_links(collection_id, USER, {node_id: _user_links(collection, embedding, payload.user_links)})
+    graph.set_links(collection_id, SEMANTIC, {node_id: s_links})
+
+    # nodes close enough to the new one may now want it among their links
+    relinked = _relink(
+        collection,
+        collection_id,
+        _back_link_candidates(
+            collection_id,
+            {id: d for id, d in zip(around_ids, around_distances) if d <= payload.distance_threshold},
+            payload.max_links,
+        ),
+        payload.max_links,
+        payload.distance_threshold,
     )
+    _changed(collection_id, inserted=[node_id], updated=relinked)
     return node_id
 
 
@@ -616,9 +1621,9 @@ async def _create_node_logic(payload: NodeInputModel):
 @app.post("/nodes/insert", dependencies=[Depends(verify_api_key)])
 async def createNode(payload: NodeInputModel, background_tasks: BackgroundTasks):
     try:
-
+        since = (await chroma.run(_open_versioned, payload.collection))[2]
         await _create_node_logic(payload)
-        background_tasks.add_task(notify_clients, "node")
+        background_tasks.add_task(notify_node_change, payload.collection, since)
         return StatusModel(status=f"Added Node {payload.name} Successfully.")
 
     except Exception as e:
@@ -627,33 +1632,205 @@ async def createNode(payload: NodeInputModel, background_tasks: BackgroundTasks)
         )
 
 
+# -- bulk insert nodes from a streamed NDJSON body --
+# one {"name", "content", "user_links"} object per line. nodes are embedded in
+# large batches, linked against the collection and the rest of their batch in
+# one pass, and written with one collection.add per batch. progress is pushed
+# over /ws as "bulk-insert" messages and clients get a single "node"
+# notification at the end.
+@app.post("/nodes/bulk-insert", dependencies=[Depends(verify_api_key)])
+async def bulkInsertNodes(
+    request: Request,
+    collection: str = Query(...),
+    max_links: int = Query(5),
+    distance_threshold: float = Query(0.7),
+    batch_size: int = Query(256, ge=1),
+):
+    try:
+        target, collection_id, since = await chroma.run(_open_versioned, collection)
+        batch_size = min(batch_size, await chroma.max_batch_size())
+    except Exception as e:
+        raise HTTPException(
+            status_code=400, detail=f"Bulk insert failed with error: {str(e)}"
+        )
+    space = collection_space(target)
+
+    async def insert_batch(batch: List[BulkNodeModel]) -> int:
+        embeddings = await model_embedding_many(
+            [f"Name: {node.name}. {node.content}" for node in batch]
+        )
+        async with chroma.writing(collection_id):
+            return await chroma.run(write_batch, batch, embeddings)
+
+    def write_batch(batch: List[BulkNodeModel], embeddings) -> int:
+        node_ids = [str(uuid.uuid1()) for _ in batch]
+
+        # wide enough to also find every existing node that should link back to the batch
+        around = _neighborhoods(target, embeddings, max_links, distance_threshold)
+        existing_ids = [ids for ids, _ in around]
+        existing_distances = [distances for _, distances in around]
+
+        s_links = batch_links(
+            node_ids,
+            embeddings,
+            existing_ids,
+            existing_distances,
+            max_links,
+            distance_threshold,
+            space,
+        )
+        target.add(
+            documents=[node.content for node in batch],
+            ids=node_ids,
+            embeddings=embeddings,
+            metadatas=[{"name": node.name} for node in batch],
+        )
+        lexical.upsert(collection_id, [(node_id, node.name, node.content) for node_id, node in zip(node_ids, batch)])
+        graph.set_links(
+            collection_id,
+            USER,
+            {
+                node_id: _user_links(target, embedding, node.user_links)
+                for node_id, embedding, node in zip(node_ids, embeddings, batch)
+                if node.user_links
+            },
+        )
+        graph.set_links(collection_id, SEMANTIC, dict(zip(node_ids, s_links)))
+
+        # existing nodes close to the batch may now want one of the new nodes as a link
+        closest: Dict[str, float] = {}
+        for row_ids, row_distances in zip(existing_ids, existing_distances):
+            for id, d in zip(row_ids, row_distances):
+                if d <= distance_threshold and d < closest.get(id, float("inf")):
+                    closest[id] = d
+        relinked = _relink(
+            target,
+            collection_id,
+            _back_link_candidates(collection_id, closest, max_links),
+            max_links,
+            distance_threshold,
+        )
+        _changed(collection_id, inserted=node_ids, updated=relinked)
+        return len(batch)
+
+    inserted = 0
+    failed = []
+    line_no = 0
+    batch: List[BulkNodeModel] = []
+    buffer = b""
+
+    def parse(line: bytes):
+        if not line.strip():
+            return
+        try:
+            batch.append(BulkNodeModel(**json.loads(line)))
+        except Exception as e:
+            failed.append({"line": line_no, "error": str(e)})
+
+    # the body is consumed here, batch by batch as it arrives (reading it from
+    # inside a StreamingResponse would race starlette's disconnect listener),
+    # so progress goes out over /ws instead
+    try:
+        async for chunk in request.stream():
+            buffer += chunk
+            *lines, buffer = buffer.split(b"\n")
+            for line in lines:
+                line_no += 1
+                parse(line)
+                if len(batch) >= batch_size:
+                    inserted += await insert_batch(batch)
+                    batch = []
+                    await notify_clients(
+                        "bulk-insert", collection=collection, inserted=inserted, failed=len(failed)
+                    )
+        if buffer:
+            line_no += 1
+            parse(buffer)
+        if batch:
+            inserted += await insert_batch(batch)
+    except Exception as e:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Bulk insert failed after {inserted} nodes with error: {str(e)}",
+        )
+    finally:
+        if inserted:
+            await notify_node_change(collection, since)
+
+    return JSONResponse(
+        content={
+            "status": f"Added {inserted} Nodes to {collection} Successfully.",
+            "inserted": inserted,
+            "failed": len(failed),
+            "errors": failed[:100],
+        }
+    )
+
+
+def _update_node(collection, collection_id: str, payload: NodeUpdateModel, embedding):
+    """The chroma / graph side of an update (chroma pool, collection write lock held)."""
+    current = collection.get(ids=[payload.node_id], include=["documents", "metadatas"])
+    if not current["ids"]:
+        raise ValueError(f"Node {payload.node_id} not found")
+    old_meta = current["metadatas"][0] or {}
+    text_changed = (
+        current["documents"][0] != payload.content or old_meta.get("name") != payload.name
+    )
+    relinked = []
+
+    around_ids, around_distances = _neighborhood(
+        collection, embedding, payload.max_links, payload.distance_threshold
+    )
+    # the node's own (old) entry may show up in the neighborhood, it never links to itself
+    s_links = _own_links(
+        payload.node_id,
+        [id for id in around_ids if id != payload.node_id],
+        [d for id, d in zip(around_ids, around_distances) if id != payload.node_id],
+        payload.max_links,
+        payload.distance_threshold,
+    )
+    old_links = graph.links_of(collection_id, [payload.node_id])[payload.node_id]
+    collection.update(
+        documents=[payload.content],
+        ids=[payload.node_id],
+        embeddings=[embedding],
+        metadatas=[{"name": payload.name}],
+    )
+    lexical.upsert(collection_id, [(payload.node_id, payload.name, payload.content)])
+    graph.set_links(collection_id, USER, {payload.node_id: _user_links(collection, embedding, payload.user_links)})
+    graph.set_links(collection_id, SEMANTIC, {payload.node_id: s_links})
+
+    if text_changed:
+        # the node moved: its former neighbors, whoever linked to it and
+        # whoever is close to it now may all have different links
+        affected = set(link_ids(old_links[SEMANTIC]))
+        affected.update(graph.reverse(collection_id, payload.node_id)[SEMANTIC])
+        affected.update(
+            _back_link_candidates(
+                collection_id,
+                {
+                    id: d
+                    for id, d in zip(around_ids, around_distances)
+                    if d <= payload.distance_threshold and id != payload.node_id
+                },
+                payload.max_links,
+            )
+        )
+        affected.discard(payload.node_id)
+        relinked = _relink(collection, collection_id, affected, payload.max_links, payload.distance_threshold)
+
+    _changed(collection_id, updated=[payload.node_id, *relinked])
+
+
 @app.post("/nodes/update", dependencies=[Depends(verify_api_key)])
 async def updateNode(payload: NodeUpdateModel, background_tasks: BackgroundTasks):
     try:
-        collection = client.get_collection(payload.collection)
+        collection, collection_id, since = await chroma.run(_open_versioned, payload.collection)
+        # embedded before taking the lock, other writes to the collection go on meanwhile
         embedding = await model_embedding(f"Name: {payload.name}. {payload.content}")
-        q_result = collection.query(
-            query_embeddings=embedding,
-            n_results=payload.max_links,
-            include=["distances"],
-        )
-
-        s_links = []
-        for i, id in enumerate(q_result["ids"][0]):
-            if q_result["distances"][0][i] <= payload.distance_threshold:
-                s_links.append(id)
-        metadata = {
-            "name": payload.name,
-            "user_links": json.dumps(payload.user_links),
-            "s_links": json.dumps(s_links),
-        }
-        collection.update(
-            documents=[payload.content],
-            ids=[payload.node_id],
-            embeddings=[embedding],
-            metadatas=[metadata],
-        )
-        background_tasks.add_task(notify_clients, "node")
+        async with chroma.writing(collection_id):
+            await chroma.run(_update_node, collection, collection_id, payload, embedding)
+        background_tasks.add_task(notify_node_change, payload.collection, since)
         return StatusModel(status=f"Updated Node {payload.name} Successfully.")
 
     except Exception as e:
@@ -662,12 +1839,34 @@ async def updateNode(payload: NodeUpdateModel, background_tasks: BackgroundTasks
         )
 
 
+def _delete_node(collection, collection_id: str, payload: NodeDeleteModel):
+    """The chroma / graph side of a delete (chroma pool, collection write lock held)."""
+    collection.delete(ids=[payload.node_id])
+    lexical.delete(collection_id, [payload.node_id])
+    # drops the node from every other node's links in one go (dst index)
+    linkers = graph.delete_node(collection_id, payload.node_id)
+
+    # with the link parameters we can also fill the freed slot with the next neighbor
+    if payload.max_links is not None and payload.distance_threshold is not None:
+        _relink(
+            collection,
+            collection_id,
+            linkers[SEMANTIC],
+            payload.max_links,
+            payload.distance_threshold,
+        )
+
+    # every linker lost an edge, relinked or not
+    _changed(collection_id, updated=linkers[USER] + linkers[SEMANTIC], deleted=[payload.node_id])
+
+
 @app.post("/nodes/delete", dependencies=[Depends(verify_api_key)])
 async def deleteNode(payload: NodeDeleteModel, background_tasks: BackgroundTasks):
     try:
-        collection = client.get_collection(payload.collection)
-        collection.delete(ids=[payload.node_id])
-        background_tasks.add_task(notify_clients, "node")
+        collection, collection_id, since = await chroma.run(_open_versioned, payload.collection)
+        async with chroma.writing(collection_id):
+            await chroma.run(_delete_node, collection, collection_id, payload)
+        background_tasks.add_task(notify_node_change, payload.collection, since)
         return StatusModel(status=f"Deleted Node Successfully.")
 
     except Exception as e:
@@ -676,31 +1875,78 @@ async def deleteNode(payload: NodeDeleteModel, background_tasks: BackgroundTasks
         )
 
 
+# -- retrieval for /query/stream --
+# "semantic" keeps the vector hits under distance_threshold, "lexical" takes the
+# BM25 hits, "hybrid" fuses both rankings (reciprocal rank fusion) and keeps
+# the best max_results. until the embedding model is loaded (or while the
+# embedding sidecar is unreachable), semantic and hybrid fall back to lexical
+# instead of waiting for it.
+async def _retrieve(payload: QueryModel, mode: str):
+    """(mode used, ids, documents) for the question, best first."""
+    collection, collection_id = await chroma.run(_open_collection, payload.collection)
+    limit = payload.max_results
+    if mode != "lexical" and not model_ready.is_set() and await asyncio.to_thread(embedding_cache.get, payload.query) is None:
+        mode = "lexical"
+    q_embedding = None
+    if mode != "lexical":
+        try:
+            q_embedding = await model_embedding(payload.query)
+        except ConnectionError as e:
+            # the embedding sidecar is down, answer from the lexical index
+            print(f"Warning: {e}; falling back to lexical retrieval")
+            mode = "lexical"
+    # both sides look deeper than max_results so fusion has something to choose from
+    depth = limit * 2 if mode == "hybrid" else limit
+
+    semantic_ids, documents = [], {}
+    if q_embedding is not None:
+        q_result = await chroma.query(
+            collection,
+            query_embeddings=q_embedding,
+            n_results=depth,
+            include=["documents", "distances"],
+        )
+        # filter by distance threshold
+        for node_id, doc, distance in zip(q_result["ids"][0], q_result["documents"][0], q_result["distances"][0]):
+            if distance <= payload.distance_threshold:
+                semantic_ids.append(node_id)
+                documents[node_id] = doc
+    if mode == "semantic":
+        return mode, semantic_ids, [documents[node_id] for node_id in semantic_ids]
+
+    hits = await asyncio.to_thread(lexical.search, collection_id, payload.query, depth)
+    lexical_ids = [node_id for node_id, _ in hits]
+    if mode == "lexical":
+        ids = lexical_ids
+    else:
+        ids = reciprocal_rank_fusion([semantic_ids, lexical_ids], k=rrf_k, limit=limit)
+    missing = [node_id for node_id in ids if node_id not in documents]
+    if missing:
+        fetched = await chroma.get(collection, ids=missing, include=["documents"])
+        documents.update(zip(fetched["ids"], fetched["documents"]))
+    ids = [node_id for node_id in ids if node_id in documents]
+    return mode, ids, [documents[node_id] for node_id in ids]
+
+
 @app.post("/query/stream", dependencies=[Depends(verify_api_key) , Depends(verify_llm_ready)])
 async def query_stream(payload: QueryModel):
-    retrieved_docs = []
+    mode = payload.retrieval_mode or retrieval_mode
+    if mode not in retrieval_modes:
+        raise HTTPException(status_code=400, detail=f"retrieval_mode must be one of {list(retrieval_modes)}")
     retrieved_ids = []
     context = "No relevant context found."
-    print(f"distance Threshold: {payload.distance_threshold}, maxlinks: {payload.max_results}")
+    context_tokens = 0
+    print(f"distance Threshold: {payload.distance_threshold}, maxlinks: {payload.max_results}, retrieval: {mode}")
 
     try:
-        collection = client.get_collection(payload.collection)
-        q_embedding = await model_embedding(payload.query)
-
-        q_result = collection.query(
-            query_embeddings=q_embedding,
-            n_results=payload.max_results,
-            include=["documents", "distances", "metadatas"],
+        mode, ids, retrieved_docs = await _retrieve(payload, mode)
+        # best documents first, long ones cut to their relevant sentences
+        packed, context_tokens, used = await asyncio.to_thread(
+            build_context, payload.query, retrieved_docs, context_token_budget, token_counter
         )
-
-        # filter by distance threshold
-        for i, doc in enumerate(q_result["documents"][0]):
-            if q_result["distances"][0][i] <= payload.distance_threshold:
-                retrieved_docs.append(doc)
-                retrieved_ids.append(q_result["ids"][0][i])
-
-        if retrieved_docs:
-            context = "\n\n".join(retrieved_docs)
+        retrieved_ids = [ids[i] for i in used]
+        if packed:
+            context = packed
 
     except Exception as e:
         print("Failed to load context:", e)
@@ -721,7 +1967,11 @@ async def query_stream(payload: QueryModel):
         except Exception as e:
             yield f"\n\n[ERROR]: {str(e)}"
 
-    headers = {"X-Retrieved-Ids": json.dumps(retrieved_ids)}
+    headers = {
+        "X-Retrieved-Ids": json.dumps(retrieved_ids),
+        "X-Retrieval-Mode": mode,
+        "X-Context-Tokens": str(context_tokens),
+    }
 
     try:
         return StreamingResponse(
@@ -807,24 +2057,24 @@ async def summarize_history(request: Request, payload: SummarizeHistoryRequest,
            
             
             # Call the same reusable logic function
+            since = (await chroma.run(_open_versioned, payload.collection))[2]
             new_node_id = await _create_node_logic(new_node_payload)
 
-            SummaryReturn = SummaryReturnModel(
-                name=summary_response.name,
-                content=summary_response.content,
-                id=new_node_id
-                
-            )
+            # same shape as SummaryReturnModel, encoded without a pydantic round trip
+            SummaryReturn = {
+                "name": summary_response.name,
+                "content": summary_response.content,
+                "id": new_node_id,
+            }
             # You have access to background_tasks here, so you can use it
-            background_tasks.add_task(notify_clients, "node")
+            background_tasks.add_task(notify_node_change, payload.collection, since)
             
             print(f"Successfully created summary node with ID: {new_node_id}")
 
         except Exception as e:
             print(f"Warning: Failed to create summary node. Error: {e}")
         
-        # Return the Pydantic object directly. FastAPI handles the JSON conversion.
-        return SummaryReturn
+        return respond(request, SummaryReturn)
 
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to generate summary: {str(e)}")
@@ -843,8 +2093,9 @@ async def clear_history(payload: ClearHistoryModel):
             connection=async_engine,
         )
 
-        # 2. Call the async clear() method
+        # 2. Call the async clear() method (and drop its rolling summary)
         await history.aclear()
+        await summary_store.clear(payload.conversation_id)
 
         # Optional: Remove the memory object from the in-memory cache if you want
         if payload.conversation_id in memory_dict:
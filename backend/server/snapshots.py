@@ -0,0 +1,114 @@
+# -- versioned response snapshots --
+#
+# after every change each connected browser re-fetches /nodes/list and
+# /collections/list at the same moment. the response for a given collection
+# version never changes, so it is serialized and gzipped once, kept here, and
+# every other request for that version gets the same bytes (or a 304 when the
+# client already has them; the etag follows from the key and the version, so
+# that check needs no snapshot at all). concurrent misses for the same key wait for the one
+# build in progress instead of each building their own.
+#
+# VersionedCache does the same for computed values that later versions are
+# derived from (graph layouts, clusterings) rather than for response bytes.
+
+import gzip
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional, Tuple
+
+
+class Snapshot:
+    __slots__ = ("version", "etag", "body", "gzipped", "media_type")
+
+    def __init__(self, version: int, etag: str, body: bytes, media_type: str = "application/json"):
+        self.version = version
+        self.etag = etag
+        self.body = body
+        self.gzipped = gzip.compress(body, compresslevel=6)
+        self.media_type = media_type
+
+
+class SnapshotCache:
+    def __init__(self, max_items: int = 128):
+        self._max_items = max_items
+        self._items: "OrderedDict[Hashable, Snapshot]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._building = {}  # key -> lock held while that key is being built
+        self._hits = 0
+        self._builds = 0
+
+    def get(self, key: Hashable, version: int, build: Callable[[], bytes], media_type: str = "application/json") -> Snapshot:
+        """The snapshot of key at version, calling build() only if nobody has built it yet."""
+        cached = self._lookup(key, version)
+        if cached is not None:
+            return cached
+
+        with self._lock:
+            building = self._building.setdefault(key, threading.Lock())
+        with building:
+            # someone else may have built it while we waited
+            cached = self._lookup(key, version)
+            if cached is not None:
+                return cached
+            body = build()
+            snapshot = Snapshot(version, self.etag(key, version), body, media_type)
+            with self._lock:
+                self._builds += 1
+                self._items[key] = snapshot
+                self._items.move_to_end(key)
+                while len(self._items) > self._max_items:
+                    self._items.popitem(last=False)
+            return snapshot
+
+    @staticmethod
+    def etag(key: Hashable, version: int) -> str:
+        """The ETag of key's snapshot at version, known without building (or even caching) it."""
+        tag = hashlib.sha1(repr(key).encode()).hexdigest()[:12]
+        return f'W/"{tag}-{version}"'
+
+    def _lookup(self, key: Hashable, version: int) -> Optional[Snapshot]:
+        with self._lock:
+            snapshot = self._items.get(key)
+            if snapshot is None or snapshot.version != version:
+                return None
+            self._items.move_to_end(key)
+            self._hits += 1
+            return snapshot
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"items": len(self._items), "hits": self._hits, "builds": self._builds}
+
+
+class VersionedCache:
+    """
+    Latest computed value per key (layouts, clusterings), rebuilt once per
+    version. build gets the previous (version, value) to update from, or None.
+    """
+
+    def __init__(self, max_items: int = 32):
+        self._max_items = max_items
+        self._items: "OrderedDict[Hashable, Tuple[int, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._building = {}
+
+    def get(self, key: Hashable, version: int, build: Callable[[Optional[Tuple[int, Any]]], Any]):
+        with self._lock:
+            cached = self._items.get(key)
+            if cached is not None and cached[0] == version:
+                self._items.move_to_end(key)
+                return cached[1]
+            building = self._building.setdefault(key, threading.Lock())
+        with building:
+            with self._lock:
+                cached = self._items.get(key)
+            if cached is not None and cached[0] == version:
+                return cached[1]
+            value = build(cached)
+            with self._lock:
+                self._items[key] = (version, value)
+                self._items.move_to_end(key)
+                while len(self._items) > self._max_items:
+                    self._items.popitem(last=False)
+            return value
@@ -107,7 +107,18 @@ const App = ({ onLogout }) => {
     }, [])
 
     // -- ws connection -- 
-    const wsRef = useWebSocket(onMessage)
+    // only the domain on screen sends us node events (domain list changes always come through)
+    const currentDomainRef = useRef(currentDomain);
+    const wsRef = useWebSocket(onMessage, currentDomainRef)
+
+    useEffect(() => {
+        currentDomainRef.current = currentDomain
+        const ws = wsRef.current
+        if (ws && ws.readyState === WebSocket.OPEN && currentDomain) {
+            ws.send(JSON.stringify({ action: "unsubscribe" }))
+            ws.send(JSON.stringify({ action: "subscribe", collections: [currentDomain] }))
+        }
+    }, [currentDomain, wsRef])
 
 
     const [activeTab, setActiveTab] = useState('All');
@@ -1,7 +1,8 @@
 import { useEffect, useRef } from "react";
 import { token, wsUrl } from "../../../backend/api-service/api_constants";
 import { ApiService } from "../../../backend/api-service/api_service";
-export function useWebSocket(onMessage) {
+// topicRef (optional) holds the collection to subscribe to on every (re)connect
+export function useWebSocket(onMessage, topicRef) {
     const wsRef = useRef(null);
     const reconnectTimeout = useRef(null);
 
@@ -16,6 +17,9 @@ export function useWebSocket(onMessage) {
 
                 wsRef.current.onopen = () => {
                     console.log("✅ Connected to server");
+                    if (topicRef && topicRef.current) {
+                        wsRef.current.send(JSON.stringify({ action: "subscribe", collections: [topicRef.current] }));
+                    }
                     if (onMessage) onMessage("reload")
                 };
                 wsRef.current.onmessage = (event) => {
@@ -50,6 +54,6 @@ export function useWebSocket(onMessage) {
                 wsRef.current.close();
             }
         };
-    }, [token, wsUrl, onMessage]);
+    }, [token, wsUrl, onMessage, topicRef]);
     return wsRef
 }
\ No newline at end of file